@@ -8,9 +8,53 @@ class CiscoDNACenterConfig(PluginConfig):
     author = "Robert Csapo"
     author_email = "rcsapo@cisco.com"
     required_settings = []
-    default_settings = {}
+    default_settings = {
+        # Devices per page when walking the Cisco DNA Center inventory (at most 500, the Cisco DNA Center cap)
+        "page_size": 500,
+        # Concurrent site membership requests per Cisco DNA Center
+        "membership_workers": 8,
+        # Maximum API requests per second per Cisco DNA Center (0 = unlimited)
+        "requests_per_second": 10,
+        # Cisco DNA Centers synced in parallel by full sync
+        "sync_workers": 4,
+        # Seconds before full sync gives up on one Cisco DNA Center
+        "sync_timeout": 3600,
+        # Objects written to Nautobot per bulk operation
+        "batch_size": 500,
+        # Full sync only reconciles changed sites/devices between full reconciles
+        "incremental": False,
+        # Seconds between full reconciles (which also purge removed items) in incremental mode
+        "full_sync_interval": 86400,
+        # Seconds before a pooled Cisco DNA Center token is renewed
+        "token_ttl": 3000,
+        # Seconds before the status dashboard refreshes its Cisco DNA Center data
+        "status_ttl": 300,
+        # Seconds the Devices/Sites pages serve cached Cisco DNA Center data (a sync refreshes it)
+        "inventory_ttl": 900,
+        # Random delay of scheduled syncs, as a fraction of each controller's interval
+        "schedule_jitter": 0.1,
+        # Seconds an interrupted sync can be resumed from its checkpoint
+        "checkpoint_ttl": 86400,
+        # Change log of a sync: "object" (one record per changed object), "summary" (one per sync) or "none"
+        "changelog": "object",
+        # Sync areas/buildings/floors as Regions/Sites/Rack Groups (instead of one Site per Cisco DNA Center site)
+        "hierarchy": False,
+        # Slug of the Site for devices that aren't assigned to a site in Cisco DNA Center (None = sync error)
+        "fallback_site": None,
+        # Record sync metrics (Prometheus, kept in Redis)
+        "metrics": True,
+    }
     base_url = "ciscodnacnautobot"
     caching_config = {}
 
+    def ready(self):
+        super().ready()
+        from . import signals  # noqa: F401
+
+        # Plugin metrics in Nautobot's Prometheus registry
+        from .ciscodnac.utilities import System
+
+        System.Metrics.register()
+
 
 config = CiscoDNACenterConfig
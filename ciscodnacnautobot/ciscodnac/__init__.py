@@ -1,12 +1,54 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.shortcuts import get_object_or_404
 from dnacentersdk import api
 from ..models import Settings
+from .utilities import System
 
 
 class CiscoDNAC:
+    class Pool:
+        """
+        Process wide pool of authenticated Cisco DNA Center API Objects
+        """
 
-    # Get all tenants from Settings
-    __tenants = Settings.objects.all().nocache()
+        # API Object (and its HTTP session) per Settings, reused until the token expires
+        __clients = {}
+        __lock = threading.Lock()
+        factory = api.DNACenterAPI
+
+        @classmethod
+        def get(cls, tenant):
+            # Changed credentials are a new entry, also for processes that didn't see the change
+            key = (tenant.pk, tenant.hostname, tenant.username, tenant.password, bool(tenant.verify))
+            with cls.__lock:
+                if key not in cls.__clients:
+                    cls.__clients[key] = {"lock": threading.Lock(), "obj": None, "created": 0}
+                entry = cls.__clients[key]
+
+            # Only one thread authenticates per Cisco DNA Center
+            with entry["lock"]:
+                if entry["obj"] is None:
+                    entry["obj"] = cls.factory(
+                        username=tenant.username,
+                        password=tenant.password,
+                        base_url="https://" + tenant.hostname,
+                        # version="2.1.2",  # TODO
+                        verify=bool(tenant.verify),
+                    )
+                    entry["created"] = time.monotonic()
+                elif time.monotonic() - entry["created"] > System.Config.get("token_ttl"):
+                    # Renew the token, but keep the HTTP session (and keep-alive connections)
+                    entry["obj"].session.refresh_token()
+                    entry["created"] = time.monotonic()
+                return entry["obj"]
+
+        @classmethod
+        def invalidate(cls, pk):
+            with cls.__lock:
+                for key in [key for key in cls.__clients if key[0] == pk]:
+                    del cls.__clients[key]
 
     def __init__(self, **kwargs):
         """
@@ -15,8 +57,11 @@ class CiscoDNAC:
         self.dnac = {}
         self.dnac_status = {}
 
-        # Single Cisco DNA Center Instance
-        if "pk" in kwargs and isinstance(kwargs["pk"], int) is True:
+        # Sync stage instrumentation (System.Profile), if any
+        self.profile = kwargs.get("profile")
+
+        # Single Cisco DNA Center Instance (Settings `pk` is an UUID)
+        if kwargs.get("pk") is not None:
 
             # Verify that the Tenant exist based on the `pk`
             tenant = get_object_or_404(Settings, pk=kwargs["pk"])
@@ -29,18 +74,22 @@ class CiscoDNAC:
                 self.dnac[tenant.hostname] = obj[1]
             return
 
-        for tenant in self.__tenants:
+        enabled = []
+        for tenant in Settings.objects.all().nocache():
             self.dnac_status[tenant.hostname] = "disabled"
 
             # Create Cisco DNA Center API Object if enabled
             if tenant.status is True:
+                enabled.append(tenant)
 
-                # Create Cisco DNA Center API Object
-                obj = self.auth(tenant)
+        # Authenticate all Cisco DNA Centers in parallel, so a slow one doesn't hold up the others
+        if len(enabled) != 0:
+            with ThreadPoolExecutor(max_workers=len(enabled)) as pool:
+                for tenant, obj in zip(enabled, pool.map(self.auth, enabled)):
 
-                # Check that Auth is successful
-                if obj:
-                    self.dnac[tenant.hostname] = obj[1]
+                    # Check that Auth is successful
+                    if obj:
+                        self.dnac[tenant.hostname] = obj[1]
         return
 
     def auth(self, tenant):
@@ -48,13 +97,7 @@ class CiscoDNAC:
         Cisco DNA Center API Object
         """
         try:
-            obj = api.DNACenterAPI(
-                username=tenant.username,
-                password=tenant.password,
-                base_url="https://" + tenant.hostname,
-                # version="2.1.2",  # TODO
-                verify=bool(tenant.verify),
-            )
+            obj = self.Pool.get(tenant)
             self.dnac_status[tenant.hostname] = "success"
             return True, obj
         except Exception as error_msg:
@@ -62,32 +105,81 @@ class CiscoDNAC:
             self.dnac_status[tenant.hostname] = error_msg
             return False
 
-    def devices(self, tenant):
+    def devices(self, tenant, offset=1):
+        """
+        Get Devices from Cisco DNA Center (generator, one page at a time)
+        """
+        # Cisco DNA Center returns at most 500 devices per page
+        limit = min(System.Config.get("page_size"), 500)
+        # The walk is bounded by the device count (devices added meanwhile are synced next time)
+        count = self.devices_count(tenant)
+        first = None
+        while offset <= count:
+            # Walk the documented pagination range (1-based), a short page can still be capped
+            page = System.Profile.call(
+                self.profile,
+                tenant,
+                "devices",
+                tenant.devices.get_network_device_by_pagination_range,
+                start_index=offset,
+                records_to_return=limit,
+            ).response
+            # Stop on an empty page, or a page that didn't move (the range isn't honored)
+            if len(page) == 0 or page[0].serialNumber == first:
+                return
+            first = page[0].serialNumber
+            for device in page:
+                yield device
+            offset += len(page)
+
+    def devices_count(self, tenant):
         """
-        Get Devices from Cisco DNA Center
+        Get Devices count from Cisco DNA Center
         """
-        return tenant.devices.get_device_list().response
+        return System.Profile.call(self.profile, tenant, "devices", tenant.devices.get_device_count).response
 
     def sites(self, tenant):
         """
         Get Sites from Cisco DNA Center
         """
-        return tenant.sites.get_site().response
+        return System.Profile.call(self.profile, tenant, "sites", tenant.sites.get_site).response
 
     def sites_count(self, tenant):
         """
         Get Sites count from Cisco DNA Center
         """
-        return tenant.sites.get_site_count().response
+        return System.Profile.call(self.profile, tenant, "sites", tenant.sites.get_site_count).response
 
     @classmethod
-    def devices_to_sites(cls, tenant):
+    def devices_to_sites(cls, tenant, sites=None, profile=None):
         """
         Map Device Serial Number to Site ID from Cisco DNA Center
         """
+
+        # Reuse Site IDs that are already fetched (e.g. by sync_sites)
+        if sites is None:
+            sites = [site.id for site in System.Profile.call(profile, tenant, "sites", tenant.sites.get_site).response]
+
+        # Membership per site is fetched concurrently, but rate limited per Cisco DNA Center
+        limit = System.RateLimit.get(tenant.base_url, System.Config.get("requests_per_second"))
+
+        def membership(site_id):
+            limit.wait()
+            try:
+                return site_id, System.Profile.call(
+                    profile, tenant, "membership", tenant.sites.get_membership, site_id=site_id
+                )
+            except Exception as error_msg:
+                # One failing site doesn't stop the others (its devices are left unassigned)
+                print("Error for {}: {}".format(site_id, error_msg))
+                return site_id, None
+
         results = {}
-        for site in tenant.sites.get_site().response:
-            for members in tenant.sites.get_membership(site_id=site.id).device:
-                for device in members.response:
-                    results[device.serialNumber] = site.id
+        with ThreadPoolExecutor(max_workers=System.Config.get("membership_workers")) as pool:
+            for site_id, site in pool.map(membership, sites):
+                if site is None:
+                    continue
+                for members in site.device:
+                    for device in members.response:
+                        results[device.serialNumber] = site_id
         return results
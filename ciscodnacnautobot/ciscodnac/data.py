@@ -1,9 +1,25 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from . import CiscoDNAC
 from cacheops import cache, CacheMiss
-from nautobot.dcim.models import Site, Device
+from nautobot.dcim.models import Site, Device, DeviceType
+from nautobot.ipam.models import IPAddress
 from nautobot.tenancy.models import Tenant
 from nautobot.extras.models import Status 
 from django_rq import get_queue, job
+from rq import get_current_job
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from ..models import Settings
 from .nautobot import Nautobot
 from .utilities import System
@@ -16,59 +32,137 @@ def full_sync(**kwargs):
     """
     data = {}
 
-    # Sync all func from Cisco DNA Center
-    sites = Data.sync_sites(**kwargs)
-    devices = Data.sync_devices(**kwargs)
+    # Single Cisco DNA Center or all enabled Cisco DNA Centers
+    if kwargs.get("pk") is not None:
+        tenants = Settings.objects.filter(pk=kwargs["pk"]).nocache()
+    else:
+        tenants = Settings.objects.filter(status=True).nocache()
 
-    # Count the synced items
-    for tenant in sites:
-        data[tenant] = {}
-        Nautobot.Purge.database(tenant=tenant, type="devices", data=devices[tenant])
-        Nautobot.Purge.database(tenant=tenant, type="sites", data=sites[tenant])
-    for tenant in sites:
-        data[tenant]["sites"] = len(sites[tenant])
-    for tenant in devices:
-        data[tenant]["devices"] = len(devices[tenant])
+    # Locks are owned by this job, which also shows the progress
+    current = get_current_job()
+    owner = current.id if current is not None else str(uuid.uuid4())
+    progress = System.Progress(current)
+    timeout = System.Config.get("sync_timeout")
+
+    # Sync each Cisco DNA Center in its own worker thread
+    def sync(tenant, holder):
+        try:
+            holder["result"] = run(tenant)
+        except Exception as error_msg:
+            holder["error"] = error_msg
+
+    def run(tenant):
+        # One sync per Cisco DNA Center at a time, also across jobs (e.g. all vs. one)
+        # (a lease left behind by a killed job is taken over)
+        lock = System.Lock.tenant(tenant.pk)
+        if System.Lock.acquire(lock, owner, timeout + 60) is False:
+            if System.Lock.stale(lock, timeout + 60) is False or System.Lock.acquire(lock, owner, timeout + 60) is False:
+                return {tenant.hostname: {"error": "Sync already running"}}
+        try:
+            return Data.sync_tenant(pk=tenant.pk, progress=progress)
+        finally:
+            System.Lock.release(lock, owner)
+            # Every worker thread has its own database connection
+            connection.close()
+
+    # At most `sync_workers` syncs at a time, the timeout counts from the start of each sync.
+    # A sync that times out gives up its worker (its thread is abandoned, but keeps its lease),
+    # so the job never runs longer than waves x sync_timeout (the job timeout and lease).
+    pending = list(tenants)
+    running = {}
+    while len(pending) != 0 or len(running) != 0:
+        while len(pending) != 0 and len(running) < System.Config.get("sync_workers"):
+            tenant = pending.pop(0)
+            holder = {}
+            thread = threading.Thread(target=sync, args=(tenant, holder), daemon=True)
+            thread.start()
+            running[tenant.hostname] = (thread, time.monotonic(), holder)
+
+        for tenant, (thread, started, holder) in list(running.items()):
+            if thread.is_alive() is True:
+                if time.monotonic() - started > timeout:
+                    del running[tenant]
+                    data[tenant] = {"error": "Timeout after {} seconds".format(timeout)}
+                    System.Metrics.failure(tenant)
+                continue
+            del running[tenant]
+            if "error" in holder:
+                # One failing Cisco DNA Center doesn't abort the others
+                print("Error for {}: {}".format(tenant, holder["error"]))
+                data[tenant] = {"error": str(holder["error"])}
+                System.Metrics.failure(tenant)
+                continue
+            result = holder["result"]
+            if tenant not in result:
+                result[tenant] = {"error": "Authentication failed"}
+                System.Metrics.failure(tenant)
+            data.update(result)
+        time.sleep(1)
+
+    # Requests for the same scope start a new job from now on
+    System.Lock.release(System.Lock.scope(kwargs.get("pk")), owner)
 
     # Return data as results for the job
     return data
 
 
+@job("default")
+def scheduled_sync():
+    """
+    RQ Background Task that starts the scheduled syncs that are due (run every minute)
+    """
+    return Data.schedule()
+
+
+@job("default")
+def status_refresh():
+    """
+    RQ Background Task for the Status Dashboard
+    """
+    return Data.status_refresh()
+
+
 class Data:
-    def status():
+    def status(refresh=False):
         """
         Plugin Status Dashboard
         """
 
-        # Create Cisco DNA Center API Instances
+        # Cisco DNA Center data comes from the snapshot of the background job
         data = {}
-        tenants = CiscoDNAC()
+        try:
+            snapshot = cache.get("ciscodnacnautobot_status")
+        except CacheMiss:
+            snapshot = {"updated": None, "dnac": {}}
+        data["updated"] = snapshot["updated"]
         data["dnac"] = {}
 
+        # Refresh the snapshot in the background when it's missing or expired
+        ttl = System.Config.get("status_ttl")
+        if refresh is True or snapshot["updated"] is None or (timezone.now() - snapshot["updated"]).total_seconds() > ttl:
+            try:
+                cache.get("ciscodnacnautobot_status_job")
+            except CacheMiss:
+                job = status_refresh.delay()
+                cache.set("ciscodnacnautobot_status_job", job.id, timeout=60)
+
         # Get local settings
         for tenant in Settings.objects.all().nocache():
-            data["dnac"][tenant.hostname] = {}
-            data["dnac"][tenant.hostname]["id"] = tenant.id
-            data["dnac"][tenant.hostname]["sites"] = None
-            data["dnac"][tenant.hostname]["devices"] = None
-        # Get API status per Cisco DNA Center
-
-        for k, v in tenants.dnac_status.items():
-            data["dnac"][k]["api"] = v
-
-        # Get data from Cisco DNA Center
-        for tenant, dnac in tenants.dnac.items():
-            data["dnac"][tenant]["sites"] = tenants.sites_count(tenant=dnac)
-            data["dnac"][tenant]["devices"] = 0
-            for device in tenants.devices(tenant=dnac):
-                if device.deviceSupportLevel == "Supported":
-                    data["dnac"][tenant]["devices"] += 1
+            data["dnac"][tenant.hostname] = {
+                "id": tenant.id,
+                "sites": None,
+                "devices": None,
+                "api": "pending" if tenant.status is True else "disabled",
+                "updated": None,
+            }
+            if tenant.status is True and tenant.hostname in snapshot["dnac"]:
+                data["dnac"][tenant.hostname].update(snapshot["dnac"][tenant.hostname])
 
         # Gather data from Nautobot
         data["nautobot"] = {}
         dnac_tag = System.PluginTag.get()
-        data["nautobot"]["sites"] = len(Site.objects.filter(tags=dnac_tag))
-        data["nautobot"]["devices"] = len(Device.objects.filter(tags=dnac_tag))
+        data["nautobot"]["sites"] = Site.objects.filter(tags=dnac_tag).count()
+        data["nautobot"]["devices"] = Device.objects.filter(tags=dnac_tag).count()
         data["nautobot"]["tenants"] = {}
 
         # Gather Tenants that is related to Cisco DNA Center
@@ -84,6 +178,244 @@ class Data:
             }
         return data
 
+    def status_refresh():
+        """
+        Plugin Status Dashboard (Cisco DNA Center data snapshot)
+        """
+
+        # Keep the last known data for Cisco DNA Centers that fail this time
+        try:
+            snapshot = cache.get("ciscodnacnautobot_status")
+        except CacheMiss:
+            snapshot = {"updated": None, "dnac": {}}
+
+        # Create Cisco DNA Center API Instances
+        tenants = CiscoDNAC()
+        for tenant, api in tenants.dnac_status.items():
+            if tenant not in snapshot["dnac"]:
+                snapshot["dnac"][tenant] = {"sites": None, "devices": None, "updated": None}
+            snapshot["dnac"][tenant]["api"] = str(api)
+
+        def count(tenant, dnac):
+            # Get data from Cisco DNA Center (devices are counted page by page)
+            result = {"sites": tenants.sites_count(tenant=dnac), "devices": 0}
+            for device in tenants.devices(tenant=dnac):
+                if device.deviceSupportLevel == "Supported":
+                    result["devices"] += 1
+            result["updated"] = timezone.now()
+            return result
+
+        # Count per Cisco DNA Center in parallel, so an unreachable one doesn't hold up the others
+        if len(tenants.dnac) != 0:
+            with ThreadPoolExecutor(max_workers=len(tenants.dnac)) as pool:
+                futures = {tenant: pool.submit(count, tenant, dnac) for tenant, dnac in tenants.dnac.items()}
+                for tenant, future in futures.items():
+                    try:
+                        snapshot["dnac"][tenant].update(future.result())
+                    except Exception as error_msg:
+                        print("Error for {}: {}".format(tenant, error_msg))
+                        snapshot["dnac"][tenant]["api"] = str(error_msg)
+
+        snapshot["updated"] = timezone.now()
+        cache.set("ciscodnacnautobot_status", snapshot, timeout=None)
+        return snapshot
+
+    class Normalize:
+        """
+        Cisco DNA Center payload as plain data (for the cache and templates)
+        """
+
+        @staticmethod
+        def device(device, site=None):
+            return {
+                "hostname": device.hostname,
+                "site": site,
+                "reachabilityStatus": device.reachabilityStatus,
+                "role": device.role,
+                "type": device.type,
+                "family": device.family,
+                "platformId": device.platformId,
+                "managementIpAddress": device.managementIpAddress,
+                "serialNumber": device.serialNumber,
+            }
+
+        @staticmethod
+        def site(site):
+            result = {
+                "name": site.name,
+                "siteNameHierarchy": site.siteNameHierarchy,
+                "type": None,
+                "country": None,
+            }
+
+            # Get addtional data about the location
+            for additionalInfo in site.additionalInfo:
+                if "Location" in additionalInfo["nameSpace"]:
+                    result["type"] = additionalInfo["attributes"]["type"]
+                    result["country"] = additionalInfo["attributes"]["country"]
+            return result
+
+    class Inventory:
+        """
+        Cisco DNA Center Devices/Sites per tenant, read through the cache (Redis)
+        """
+
+        @staticmethod
+        def key(kind, tenant):
+            return "ciscodnacnautobot_{}_{}".format(kind, tenant)
+
+        @staticmethod
+        def tenants(**kwargs):
+            if kwargs.get("pk") is not None:
+                return [get_object_or_404(Settings, pk=kwargs["pk"])]
+            return Settings.objects.filter(status=True).nocache()
+
+        @classmethod
+        def get(cls, kind, **kwargs):
+            data = {}
+            for tenant in cls.tenants(**kwargs):
+                key = cls.key(kind, tenant.hostname)
+                try:
+                    data[tenant.hostname] = cache.get(key)
+                except CacheMiss:
+                    # Only gather data from Cisco DNA Center if not cached
+                    tenants = CiscoDNAC(pk=tenant.pk)
+                    if tenant.hostname not in tenants.dnac:
+                        continue
+                    dnac = tenants.dnac[tenant.hostname]
+                    if kind == "devices":
+                        # Site of every device as synced to Nautobot, so devices can be filtered/sorted by site
+                        # (one query, instead of fetching the membership of every site in the request)
+                        sites = dict(
+                            Device.objects.filter(tenant__name=tenant.hostname).values_list("serial", "site__name")
+                        )
+                        results = [
+                            Data.Normalize.device(device, sites.get(device.serialNumber))
+                            for device in tenants.devices(tenant=dnac)
+                        ]
+                    else:
+                        results = [Data.Normalize.site(site) for site in tenants.sites(tenant=dnac)]
+                        results = sorted(results, key=lambda k: k["siteNameHierarchy"], reverse=False)
+                    meta = {"etag": System.Fingerprint.create(results), "updated": timezone.now()}
+                    data[tenant.hostname] = dict(meta, data=results)
+                    ttl = System.Config.get("inventory_ttl")
+                    cache.set(key, data[tenant.hostname], timeout=ttl)
+                    cache.set(key + "_meta", meta, timeout=ttl)
+            return data
+
+        @classmethod
+        def meta(cls, kind, **kwargs):
+            """
+            ETag and Last-Modified of the cached data (None if anything isn't cached)
+            """
+            etags = []
+            updated = []
+            for tenant in cls.tenants(**kwargs):
+                try:
+                    meta = cache.get(cls.key(kind, tenant.hostname) + "_meta")
+                except CacheMiss:
+                    return None
+                etags.append(meta["etag"])
+                updated.append(meta["updated"])
+            if len(updated) == 0:
+                return None
+            return System.Fingerprint.create(etags), max(updated)
+
+        @classmethod
+        def conditional(cls, request, kind, **kwargs):
+            """
+            304 Not Modified response if the cached data matches the request (or None)
+            """
+            meta = cls.meta(kind, **kwargs)
+            if meta is None:
+                return None
+            return get_conditional_response(request, etag=quote_etag(meta[0]), last_modified=int(meta[1].timestamp()))
+
+        @classmethod
+        def headers(cls, response, kind, **kwargs):
+            meta = cls.meta(kind, **kwargs)
+            if meta is not None:
+                response["ETag"] = quote_etag(meta[0])
+                response["Last-Modified"] = http_date(meta[1].timestamp())
+            return response
+
+        @classmethod
+        def invalidate(cls, tenant):
+            for kind in ["devices", "sites"]:
+                cache.delete(cls.key(kind, tenant))
+                cache.delete(cls.key(kind, tenant) + "_meta")
+
+    class Query:
+        """
+        Filter, sort and paginate cached Cisco DNA Center data (server side)
+        """
+
+        # Query parameter -> (field, exact match)
+        filters = {
+            "devices": {
+                "hostname": ("hostname", False),
+                "site": ("site", False),
+                "role": ("role", True),
+                "reachability": ("reachabilityStatus", True),
+                "family": ("family", True),
+            },
+            "sites": {
+                "name": ("siteNameHierarchy", False),
+                "type": ("type", True),
+                "country": ("country", True),
+            },
+        }
+        sort = {
+            "devices": ["hostname", "site", "reachabilityStatus", "role", "type", "platformId", "managementIpAddress", "serialNumber", "family"],
+            "sites": ["name", "siteNameHierarchy", "type", "country"],
+        }
+
+        @classmethod
+        def get(cls, kind, data, params, per_page):
+            # Only known filters, case insensitive
+            filters = []
+            for param, (field, exact) in cls.filters[kind].items():
+                value = params.get(param, "").strip().lower()
+                if value != "":
+                    filters.append((field, exact, value))
+
+            # Only known fields, "-" for descending
+            sort = params.get("sort", "")
+            if sort.lstrip("-") not in cls.sort[kind]:
+                sort = ""
+
+            results = {}
+            for tenant, rows in data.items():
+                if len(filters) != 0:
+                    rows = [row for row in rows if cls.match(row, filters)]
+                if sort != "":
+                    rows = sorted(
+                        rows,
+                        key=lambda k: (k.get(sort.lstrip("-")) is None, str(k.get(sort.lstrip("-"))).lower()),
+                        reverse=sort.startswith("-"),
+                    )
+                results[tenant] = Paginator(rows, per_page).get_page(params.get("page"))
+            return results
+
+        @staticmethod
+        def querystrings(params):
+            """
+            Current query without page (for sort/filter links) and without sort (for column headers)
+            """
+            params = params.copy()
+            params.pop("page", None)
+            query = params.urlencode()
+            sort = params.pop("sort", [""])[-1]
+            return {"query": query, "filters": params.urlencode(), "sort": sort}
+
+        @staticmethod
+        def match(row, filters):
+            for field, exact, value in filters:
+                field = str(row.get(field) or "").lower()
+                if (exact and field != value) or (not exact and value not in field):
+                    return False
+            return True
+
     def devices(**kwargs):
         """
         Cisco DNA Center Instance Devices
@@ -91,9 +423,8 @@ class Data:
 
         # Gather all devices from Cisco DNA Center Inventory (no sync)
         data = {}
-        tenants = CiscoDNAC(**kwargs)
-        for tenant, dnac in tenants.dnac.items():
-            data[tenant] = tenants.devices(tenant=dnac)
+        for tenant, inventory in Data.Inventory.get("devices", **kwargs).items():
+            data[tenant] = inventory["data"]
         return data
 
     def sites(**kwargs):
@@ -103,32 +434,39 @@ class Data:
 
         # Gather all sites from Cisco DNA Center Network Designs (no sync)
         data = {}
+        for tenant, inventory in Data.Inventory.get("sites", **kwargs).items():
+            data[tenant] = inventory["data"]
+        return data
+
+    def export(kind, format="ndjson", **kwargs):
+        """
+        Cisco DNA Center Devices/Sites as NDJSON or JSON (generator, for streaming)
+        """
+
+        # Authenticate before streaming, so only Cisco DNA Center is called while streaming
         tenants = CiscoDNAC(**kwargs)
-        for tenant, dnac in tenants.dnac.items():
-            results = []
-            for site in tenants.sites(tenant=dnac):
-
-                # Get addtional data about the location
-                if len(site.additionalInfo) != 0:
-                    for additionalInfo in site.additionalInfo:
-                        if "Location" in additionalInfo["nameSpace"]:
-                            result = {
-                                "name": site.name,
-                                "siteNameHierarchy": site.siteNameHierarchy,
-                                "type": additionalInfo["attributes"]["type"],
-                                "country": additionalInfo["attributes"]["country"],
-                            }
+
+        def rows():
+            for tenant, dnac in tenants.dnac.items():
+                if kind == "devices":
+                    # Devices are fetched page by page, and sent as each page arrives
+                    for device in tenants.devices(tenant=dnac):
+                        yield dict(Data.Normalize.device(device), tenant=tenant)
                 else:
-                    result = {
-                        "name": site.name,
-                        "siteNameHierarchy": site.siteNameHierarchy,
-                        "type": None,
-                        "country": None,
-                    }
-                results.append(result)
-            results = sorted(results, key=lambda k: k["siteNameHierarchy"], reverse=False)
-            data[tenant] = results
-        return data
+                    for site in tenants.sites(tenant=dnac):
+                        yield dict(Data.Normalize.site(site), tenant=tenant)
+
+        def stream():
+            if format == "json":
+                yield "["
+                for index, row in enumerate(rows()):
+                    yield ("," if index != 0 else "") + json.dumps(row, default=str)
+                yield "]"
+            else:
+                for row in rows():
+                    yield json.dumps(row, default=str) + "\n"
+
+        return stream()
 
     @classmethod
     def sync_full(cls, **kwargs):
@@ -147,22 +485,194 @@ class Data:
                 return None
             return data.result
 
-        # Check if ongoing RQ Job is ongoing
-        try:
-            job = cache.get("ciscodnacnautobot_bg")
-        except CacheMiss:
-            # If not, start full sync task
-            job = full_sync.delay(**kwargs)
-            cache.set("ciscodnacnautobot_bg", job.id, timeout=600)
-
-        # Get Job Status
-        j = queue.fetch_job(cache.get("ciscodnacnautobot_bg"))
-        if "finished" == j.get_status():
-            # Start again, if cache expired
-            job = full_sync.delay(**kwargs)
-            cache.set("ciscodnacnautobot_bg", job.id, timeout=600)
-        data["id"] = str(j.id)
-        data["task"] = str(j.func_name)
+        # One job per scope (one or all Cisco DNA Centers), later requests attach to it
+        scope = System.Lock.scope(kwargs.get("pk"))
+        tenants = 1 if kwargs.get("pk") is not None else Settings.objects.filter(status=True).nocache().count()
+        waves = -(-max(tenants, 1) // System.Config.get("sync_workers"))
+        lease = System.Config.get("sync_timeout") * waves + 60
+        data["task"] = "{}.{}".format(full_sync.__module__, full_sync.__name__)
+        for attempt in range(3):
+            job_id = str(uuid.uuid4())
+            if System.Lock.acquire(scope, job_id, lease):
+                # The job may run as long as its lease (the queue default is minutes)
+                queue.enqueue_call(func=full_sync, kwargs=kwargs, job_id=job_id, timeout=lease)
+                data.update(id=job_id, running=False)
+                return data
+
+            # Attach to the running job, unless the lease outlived it (e.g. worker killed)
+            # (a lease that was just taken counts as running, its job may not be enqueued yet)
+            owner = System.Lock.owner(scope)
+            if owner is not None and System.Lock.stale(scope, lease) is False:
+                data.update(id=owner, running=True)
+                return data
+
+        # Lost the race every time, show the job that won it
+        data.update(id=System.Lock.owner(scope) or job_id, running=True)
+        return data
+
+    def schedule():
+        """
+        Start full sync of every Cisco DNA Center that is due (own interval, with jitter)
+        """
+        data = {}
+        now = timezone.now()
+        for tenant in Settings.objects.filter(status=True, sync_interval__gt=0).nocache():
+            state = System.State.get(tenant.hostname)
+            interval = tenant.sync_interval * 60
+
+            # First run somewhere within the interval, so controllers don't start at the same time
+            if state.next_sync is None:
+                state.next_sync = now + timedelta(seconds=random.uniform(0, interval))
+                state.save(update_fields=["next_sync"])
+            if state.next_sync > now:
+                continue
+
+            # Never overlap syncs of one Cisco DNA Center
+            job = Data.sync_full(pk=tenant.pk)
+            if job is None or job["running"] is True:
+                data[tenant.hostname] = "running"
+                continue
+
+            jitter = random.uniform(0, interval * System.Config.get("schedule_jitter"))
+            state.next_sync = now + timedelta(seconds=interval + jitter)
+            state.save(update_fields=["next_sync"])
+            data[tenant.hostname] = job["id"]
+        return data
+
+    @staticmethod
+    def purge_failed(failed):
+        """
+        Objects the purge couldn't delete, as rows of the sync results
+        """
+        return [
+            {
+                "name": item["name"],
+                "status": "Failed",
+                "status_label": "danger",
+                "slug": item.get("slug"),
+                "serial": item.get("serial"),
+                "sync_status": "Error: Purge of {} failed: {}".format(item["type"], item["error"]),
+                "purge": True,
+            }
+            for item in failed
+        ]
+
+    @staticmethod
+    def locked(func, **kwargs):
+        """
+        Sync per Cisco DNA Center (e.g. sync_sites from its view), under the lease that full_sync takes
+        """
+        data = {}
+        owner = "web:{}".format(uuid.uuid4())
+        lease = System.Config.get("sync_timeout") + 60
+        for tenant in Data.Inventory.tenants(**kwargs):
+            lock = System.Lock.tenant(tenant.pk)
+            if System.Lock.acquire(lock, owner, lease) is False:
+                if System.Lock.stale(lock, lease) is False or System.Lock.acquire(lock, owner, lease) is False:
+                    data[tenant.hostname] = [{"sync_status": "Error: Sync already running"}]
+                    continue
+            try:
+                data.update(func(**dict(kwargs, pk=tenant.pk)))
+            finally:
+                System.Lock.release(lock, owner)
+        return data
+
+    @classmethod
+    def sync_tenant(cls, **kwargs):
+        """
+        Sync one Cisco DNA Center (sites before devices)
+        """
+        data = {}
+
+        # Lookups are shared by sites and devices for the whole sync
+        cache = Nautobot.Cache()
+
+        # Time/queries/requests per stage of the sync
+        profile = System.Profile()
+
+        # Progress of the sync (e.g. in the RQ job of full_sync)
+        progress = kwargs.pop("progress", None) or System.Progress()
+
+        hostname = Settings.objects.get(pk=kwargs["pk"]).hostname
+        state = System.State.get(hostname)
+        started = timezone.now()
+
+        # Resume an interrupted sync from its checkpoint, unless it's too old
+        checkpoint = state.checkpoint or {}
+        if "started" in checkpoint:
+            age = (started - parse_datetime(checkpoint["started"])).total_seconds()
+            if age > System.Config.get("checkpoint_ttl"):
+                checkpoint = {}
+        resumed = "started" in checkpoint
+        if resumed is True:
+            started = parse_datetime(checkpoint["started"])
+            incremental = checkpoint["incremental"]
+        else:
+            # Only reconcile changes, unless a periodic full reconcile (to catch deletes) is due
+            incremental = False
+            if System.Config.get("incremental") is True and state.last_full_sync is not None:
+                age = (started - state.last_full_sync).total_seconds()
+                incremental = age < System.Config.get("full_sync_interval")
+            checkpoint = {
+                "started": started.isoformat(),
+                "incremental": incremental,
+                "stage": "sites",
+                "watermark": state.devices_watermark,
+            }
+            System.Seen.clear(hostname)
+            state.checkpoint = checkpoint
+            state.save(update_fields=["checkpoint"])
+        progress.update(hostname, stage=checkpoint["stage"], resumed=resumed)
+
+        # Sync all func from Cisco DNA Center (devices are checkpointed per batch)
+        with profile.stage("total"):
+            if checkpoint["stage"] == "sites":
+                sites = cls.sync_sites(cache=cache, profile=profile, progress=progress, incremental=incremental, **kwargs)
+                if hostname in sites:
+                    synced = [result for result in sites[hostname] if result.get("purge") is not True]
+                    checkpoint.update(stage="devices", sites=len(synced))
+                    state = System.State.get(hostname)
+                    state.checkpoint = checkpoint
+                    state.save(update_fields=["checkpoint"])
+            else:
+                # Sites were synced before the interruption
+                sites = None
+            devices = cls.sync_devices(
+                sites=sites,
+                cache=cache,
+                profile=profile,
+                progress=progress,
+                incremental=incremental,
+                checkpoint=True,
+                **kwargs,
+            )
+
+        # Count the synced items (sync_sites/sync_devices already purged removed items)
+        for tenant in devices:
+            data[tenant] = {}
+            data[tenant]["sites"] = checkpoint.get("sites", 0)
+            data[tenant]["devices"] = System.Seen.count(tenant)
+            data[tenant]["cache"] = cache.stats()
+            data[tenant]["mode"] = ("incremental" if incremental else "full") + (" (resumed)" if resumed else "")
+            data[tenant]["profile"] = profile.results()
+            data[tenant]["purge_failed"] = [
+                result
+                for result in ((sites or {}).get(tenant, []) + devices[tenant])
+                if result.get("purge") is True
+            ]
+            System.Metrics.sync(tenant, profile, data[tenant]["cache"])
+
+            # Keep track of the sync (sync_sites/sync_devices saved their own watermarks)
+            # (every path only saves the fields it owns, concurrent syncs never overwrite each other)
+            state = System.State.get(tenant)
+            state.last_sync = started
+            if incremental is False:
+                state.last_full_sync = started
+            state.checkpoint = {}
+            state.save(update_fields=["last_sync", "last_full_sync", "checkpoint"])
+            cache.changelog.summary(tenant)
+            System.Seen.clear(tenant)
+            progress.update(tenant, stage="done")
         return data
 
     @classmethod
@@ -171,55 +681,134 @@ class Data:
         Sync Cisco DNA Center Sites
         """
 
+        # Skip writes when the site list is unchanged since the last sync
+        incremental = kwargs.pop("incremental", False)
+
+        # Lookup cache for the sync (e.g. shared with sync_devices by full_sync)
+        # (the owner of the cache writes the change log summary)
+        shared = kwargs.get("cache") is not None
+        cache = kwargs.pop("cache", None) or Nautobot.Cache()
+
+        # Stage instrumentation (e.g. shared with sync_devices by full_sync)
+        profile = kwargs.pop("profile", None) or System.Profile()
+
+        # Progress of the sync (e.g. in the RQ job of full_sync)
+        progress = kwargs.pop("progress", None) or System.Progress()
+
         # Sync mandatory tag for Cisco DNA Center in Nautobot
-        dnac_tag = Nautobot.Sync.tags(task="system")
+        with profile.stage("sync.tags"):
+            dnac_tag = Nautobot.Sync.tags(task="system", cache=cache)
 
         # Gather all sites in Cisco DNA Center Network Designs
         data = {}
-        tenants = CiscoDNAC(**kwargs)
+        batch_size = System.Config.get("batch_size")
+        with profile.stage("auth"):
+            tenants = CiscoDNAC(profile=profile, **kwargs)
         for tenant, dnac in tenants.dnac.items():
             results = []
             # Sync Cisco DNA Center Tenant
-            Nautobot.Sync.tenants(task="system", tenant=tenant, slug=tenant.replace(".", "-"))
+            with profile.stage("sync.tenants"):
+                Nautobot.Sync.tenants(task="system", tenant=tenant, slug=tenant.replace(".", "-"), cache=cache)
             # Add tag to Cisco DNA Center Tenant
-            Nautobot.Sync.tags(
-                task="update",
-                model="tenant",
-                filter=tenant,
-                tag=dnac_tag,
-            )
-            for site in tenants.sites(tenant=dnac):
-                # Sync Site
-                # Unique name for `Global` as it can't be duplicate in Nautobot
-                if site.siteNameHierarchy == "Global":
-                    suffix = site.id.split("-")
-                    site.siteNameHierarchy = "{} {}".format(site.siteNameHierarchy, suffix[0])
-
-                # Use Cisco DNA Center UUID for Site as Slug
-                site.slug = site.id
-                site.sync = Nautobot.Sync.site(tenant=tenant, site=site)
-
-                # Add tag to Site
+            with profile.stage("sync.tags"):
                 Nautobot.Sync.tags(
                     task="update",
-                    model="site",
-                    filter=site.siteNameHierarchy,
+                    model="tenant",
+                    filter=tenant,
                     tag=dnac_tag,
                 )
+            # Fingerprint of the site list, to detect changes
+            with profile.stage("sites"):
+                dnac_sites = tenants.sites(tenant=dnac)
+            state = System.State.get(tenant)
+            fingerprint = System.Fingerprint.create(dnac_sites)
+            unchanged = incremental is True and fingerprint == state.sites_fingerprint
 
-                site.status = "Active"
-                site.status_label = "success"
-                result = {
-                    "name": site.name,
-                    "status": site.status,
-                    "status_label": site.status_label,
-                    "slug": site.slug,
-                    "sync_status": site.sync[1],
-                }
-                results.append(result)
+            # Areas, buildings and floors as Regions, Sites and Rack Groups (each level in bulk)
+            hierarchy = System.Config.get("hierarchy") is True
+            if unchanged is False and hierarchy is True:
+                with transaction.atomic(), profile.stage("sync.site"):
+                    synced = Nautobot.Sync.hierarchy(tenant=tenant, sites=dnac_sites, cache=cache)
+                    cache.save()
+
+            tagged = []
+            for i in range(0, len(dnac_sites), batch_size):
+                # One transaction per batch of sites
+                with transaction.atomic():
+                    for site in dnac_sites[i : i + batch_size]:
+                        # Sync Site
+                        # Unique name for `Global` as it can't be duplicate in Nautobot
+                        if site.siteNameHierarchy == "Global":
+                            suffix = site.id.split("-")
+                            site.siteNameHierarchy = "{} {}".format(site.siteNameHierarchy, suffix[0])
+
+                        # Use Cisco DNA Center UUID for Site as Slug
+                        site.slug = site.id
+                        site.status = "Active"
+                        site.status_label = "success"
+                        if unchanged is True:
+                            site.sync = None, "Unchanged"
+                        elif hierarchy is True:
+                            # Synced above (only buildings are Sites)
+                            site.sync = synced[site.id]
+                            if isinstance(site.sync[0], Site):
+                                tagged.append(site.sync[0].pk)
+                            elif site.sync[1].startswith("Error"):
+                                site.status = "Failed"
+                                site.status_label = "danger"
+                        else:
+                            # A failing site only rolls back itself
+                            try:
+                                with cache.atomic(), profile.stage("sync.site"):
+                                    site.sync = Nautobot.Sync.site(tenant=tenant, site=site, cache=cache)
+                                tagged.append(site.sync[0].pk)
+                            except Exception as error_msg:
+                                print("Error for {}: {}".format(site.siteNameHierarchy, error_msg))
+                                site.sync = None, "Error: {}".format(error_msg)
+                                site.status = "Failed"
+                                site.status_label = "danger"
+
+                        result = {
+                            "name": site.name,
+                            "status": site.status,
+                            "status_label": site.status_label,
+                            "slug": site.slug,
+                            "sync_status": site.sync[1],
+                        }
+                        results.append(result)
+
+                    # Fingerprints are committed with the batch
+                    cache.save()
+
+            if unchanged is False:
+                # Add tag to Sites
+                with profile.stage("sync.tags"):
+                    Nautobot.Sync.tags(task="bulk", model=Site, ids=tagged, tag=dnac_tag)
 
-            # If site is removed in Cisco DNA Center, then remove in Nautobot
-            Nautobot.Purge.database(tenant=tenant, type="sites", data=results)
+                # If site is removed in Cisco DNA Center, then remove in Nautobot
+                # (Regions/Rack Groups only exist in hierarchy mode, so they are purged otherwise)
+                with profile.stage("purge.sites"):
+                    levels = {None: [], "area": [], "building": [], "floor": []}
+                    if hierarchy is True:
+                        for site in dnac_sites:
+                            levels[Nautobot.Sync.level(site)].append({"slug": site.id})
+                    else:
+                        levels["building"] = results
+                    purged = Nautobot.Purge.database(tenant=tenant, type="sites", data=levels["building"], cache=cache)
+                    for kind, level in (("rackgroups", "floor"), ("regions", "area")):
+                        more = Nautobot.Purge.database(tenant=tenant, type=kind, data=levels[level], cache=cache)
+                        purged["purged"] += more["purged"]
+                        purged["failed"].extend(more["failed"])
+                System.Metrics.objects(tenant, "sites", results, purged["purged"])
+                results.extend(Data.purge_failed(purged["failed"]))
+
+                state.sites_fingerprint = fingerprint
+                state.save(update_fields=["sites_fingerprint"])
+                cache.save()
+                if shared is False:
+                    cache.changelog.summary(tenant)
+                Data.Inventory.invalidate(tenant)
+            progress.update(tenant, stage="sites", done=len(results), total=len(results))
             results = sorted(results, key=lambda k: k["name"], reverse=False)
             data[tenant] = results
         return data
@@ -230,12 +819,232 @@ class Data:
         Sync Cisco DNA Center Devices
         """
 
+        # Sites already synced (e.g. by full_sync), to skip fetching them again
+        sites = kwargs.pop("sites", None)
+
+        # Only sync devices updated in Cisco DNA Center since the last sync
+        incremental = kwargs.pop("incremental", False)
+
+        # Lookup cache for the sync (e.g. shared with sync_sites by full_sync)
+        # (the owner of the cache writes the change log summary)
+        shared = kwargs.get("cache") is not None
+        cache = kwargs.pop("cache", None) or Nautobot.Cache()
+
+        # Stage instrumentation (e.g. shared with sync_sites by full_sync)
+        profile = kwargs.pop("profile", None) or System.Profile()
+
+        # Progress of the sync (e.g. in the RQ job of full_sync)
+        progress = kwargs.pop("progress", None) or System.Progress()
+
+        # Resume from (and keep up to date) the checkpoint of sync_tenant
+        checkpoint = kwargs.pop("checkpoint", False)
+
         # Sync mandatory tag for Cisco DNA Center
-        dnac_tag = Nautobot.Sync.tags(task="system")
+        with profile.stage("sync.tags"):
+            dnac_tag = Nautobot.Sync.tags(task="system", cache=cache)
+
+        # Site for devices without site membership in Cisco DNA Center
+        fallback_site = None
+        if System.Config.get("fallback_site") is not None:
+            fallback_site = Site.objects.filter(slug=System.Config.get("fallback_site")).first()
+            if fallback_site is None:
+                print("Error for fallback_site: Site {} not found".format(System.Config.get("fallback_site")))
+
+        def prepare(device, context):
+            """
+            Sync what the Device refers to (Manufacturer, Device Type, Role and Site)
+            """
+            tenant = context["tenant"]
+
+            # Sync Manufacture
+            device.manufacture = device.type.split()[0]
+            with profile.stage("sync.manufacturer"):
+                device.manufacture = Nautobot.Sync.manufacturer(
+                    manufacture=device.manufacture,
+                    tenant=tenant,
+                    cache=cache,
+                )
+
+            # Sync Device Types
+            slug = System.Slug.create(device.family)
+            with profile.stage("sync.devicetype"):
+                device.family_type = Nautobot.Sync.devicetype(
+                    manufacture=device.manufacture,
+                    model=device.family,
+                    slug=slug,
+                    tenant=tenant,
+                    cache=cache,
+                )
+
+            # Sync Device Roles
+            slug = System.Slug.create(device.role)
+            with profile.stage("sync.devicerole"):
+                device.role = Nautobot.Sync.devicerole(role=device.role, slug=slug, tenant=tenant, cache=cache)
+
+            # Device Site Location
+            # (devices without a synced site go to the fallback site, if there is one)
+            with profile.stage("sync.site"):
+                device.site = context["site_index"].get(context["site_members"].get(device.serialNumber))
+                if device.site is None:
+                    device.site = fallback_site
+                if device.site is None:
+                    raise Exception("Not assigned to a synced site in Cisco DNA Center")
+
+            # Check if devices is reachable from Cisco DNA Center
+            if device.reachabilityStatus == "Reachable":
+                device.status = cache.get("status", "active", lambda: Status.objects.get(slug="active"))
+                device.status_label = "success"
+            else:
+                device.status = cache.get("status", "failed", lambda: Status.objects.get(slug="failed"))
+                device.status_label = "danger"
+
+        def failed(device, error_msg):
+            print("Error for {}: {}".format(device.hostname, error_msg))
+            return {
+                "name": device.hostname,
+                "status": "Failed",
+                "status_label": "danger",
+                "role": device.role,
+                "type": device.family,
+                "site": None,
+                "primary_ip4": device.managementIpAddress,
+                "serial": device.serialNumber,
+                "sync_status": "Error: {}".format(error_msg),
+            }
+
+        def sync(batch, context):
+            """
+            Sync one batch of Devices in one transaction (a failing Device only rolls back itself)
+            """
+            results = []
+            if len(batch) == 0:
+                return results
+            tenant = context["tenant"]
+
+            # Site membership and index are loaded once per tenant (when the first batch needs them)
+            # (outside the per-device savepoints, a failure mustn't make the next device fetch them again)
+            if context["site_members"] is None:
+                with profile.stage("membership"):
+                    try:
+                        context["site_members"] = CiscoDNAC.devices_to_sites(
+                            tenant=context["dnac"],
+                            sites=context["site_ids"],
+                            profile=profile,
+                        )
+                    except Exception as error_msg:
+                        print("Error for {}: {}".format(tenant, error_msg))
+                        context["site_members"] = {}
+            if context["site_index"] is None:
+                with profile.stage("sync.site"):
+                    context["site_index"] = Nautobot.Sync.sites_index(tenant)
+
+            with transaction.atomic():
+                prepared = []
+                for device in batch:
+                    try:
+                        with cache.atomic():
+                            prepare(device, context)
+                        prepared.append(device)
+                        context["devicetypes"].add(device.family_type.pk)
+                    except Exception as error_msg:
+                        results.append(failed(device, error_msg))
+
+                # Sync Device IP Addresses (assigned to the Devices by their upsert)
+                addresses = {}
+                with profile.stage("sync.ipaddress"):
+                    try:
+                        with cache.atomic():
+                            addresses = Nautobot.Sync.ipaddresses(tenant=tenant, devices=prepared, cache=cache)
+                    except Exception:
+                        # Retry one by one, so one IP Address can't fail the batch
+                        for device in list(prepared):
+                            try:
+                                with cache.atomic():
+                                    addresses.update(
+                                        Nautobot.Sync.ipaddresses(tenant=tenant, devices=[device], cache=cache)
+                                    )
+                            except Exception as error_msg:
+                                prepared.remove(device)
+                                results.append(failed(device, error_msg))
+                for device in prepared:
+                    device.primary_ip4 = addresses[device.managementIpAddress]
+
+                sync_status = {}
+                with profile.stage("sync.devices"):
+                    try:
+                        with cache.atomic():
+                            sync_status = Nautobot.Sync.devices(tenant=tenant, devices=prepared, cache=cache)
+                    except Exception:
+                        # Retry one by one, so one device can't fail the batch
+                        for device in list(prepared):
+                            try:
+                                with cache.atomic():
+                                    sync_status.update(Nautobot.Sync.devices(tenant=tenant, devices=[device], cache=cache))
+                            except Exception as error_msg:
+                                prepared.remove(device)
+                                results.append(failed(device, error_msg))
+
+                # Add tag to Devices and IP Addresses
+                with profile.stage("sync.tags"):
+                    Nautobot.Sync.tags(
+                        task="bulk",
+                        model=Device,
+                        ids=[obj.pk for obj, status in sync_status.values()],
+                        tag=dnac_tag,
+                    )
+                    Nautobot.Sync.tags(
+                        task="bulk",
+                        model=IPAddress,
+                        ids=[device.primary_ip4.pk for device in prepared],
+                        tag=dnac_tag,
+                    )
+
+                # Fingerprints are committed with the batch
+                cache.save()
+
+            for device in prepared:
+                result = {
+                    "name": device.hostname,
+                    "status": device.status,
+                    "status_label": device.status_label,
+                    "role": device.role,
+                    "type": device.family_type,
+                    "site": device.site,
+                    "primary_ip4": device.primary_ip4,
+                    "serial": device.serialNumber,
+                    "sync_status": sync_status[device.serialNumber][1],
+                }
+                results.append(result)
+            return results
+
+        def save(tenant, state, position, batch, synced, marks):
+            """
+            Checkpoint after a synced batch, an interrupted sync skips its devices
+            """
+            # Last update of the synced devices, and the first of the failed ones
+            updated = {device.serialNumber: device.lastUpdateTime for device in batch}
+            for result in synced:
+                updated_at = updated.get(result["serial"])
+                if updated_at is None:
+                    continue
+                if str(result["sync_status"]).startswith("Error"):
+                    marks["failed"] = min(marks["failed"] or updated_at, updated_at)
+                else:
+                    marks["synced"] = max(marks["synced"] or 0, updated_at)
+            if checkpoint is True:
+                # Failed devices aren't marked, a resumed sync retries them
+                System.Seen.add(
+                    tenant,
+                    [result["serial"] for result in synced if not str(result["sync_status"]).startswith("Error")],
+                )
+                state.save(update_fields=["checkpoint"])
+            progress.update(tenant, done=position)
 
         # Gather all devices in Cisco DNA Center Inventory
         data = {}
-        tenants = CiscoDNAC(**kwargs)
+        batch_size = System.Config.get("batch_size")
+        with profile.stage("auth"):
+            tenants = CiscoDNAC(profile=profile, **kwargs)
         for tenant, dnac in tenants.dnac.items():
             results = []
 
@@ -243,14 +1052,33 @@ class Data:
             if System.Check.sites(tenant=tenant) is False:
                 data[tenant] = [{"sync_status": "Error: Sync sites first"}]
                 continue
-            # Map Devices (Serial) against Site UUID
-            site_members = CiscoDNAC.devices_to_sites(tenant=dnac)
+            # Map Devices (Serial) against Site UUID (fetched when the first device needs it)
+            site_ids = None
+            if sites is not None and tenant in sites:
+                site_ids = [site["slug"] for site in sites[tenant] if site.get("purge") is not True]
 
-            # Get devices from Cisco DNA Center
-            for device in tenants.devices(tenant=dnac):
+            # Devices last updated (epoch ms) in Cisco DNA Center at the previous sync
+            state = System.State.get(tenant)
+            watermark = state.devices_watermark
+
+            # Resume by walking the inventory from the start, skipping devices synced before
+            # (offsets shift when devices are added/removed in Cisco DNA Center meanwhile)
+            seen = set()
+            if checkpoint is True:
+                watermark = state.checkpoint.get("watermark", watermark)
+                seen = set(System.Seen.get(tenant))
+
+            # The watermark only moves when the run completes (marks are kept in the checkpoint)
+            marks = {"synced": None, "failed": None}
+            if checkpoint is True:
+                marks = state.checkpoint.setdefault("marks", marks)
+            position = 0
+            progress.update(tenant, stage="devices", done=position, total=tenants.devices_count(tenant=dnac))
 
-                # Sync Cisco DNA Center Tenant
-                Nautobot.Sync.tenants(task="system", tenant=tenant, slug=tenant.replace(".", "-"))
+            # Sync Cisco DNA Center Tenant (once, not per device)
+            with profile.stage("sync.tenants"):
+                tenant_obj = Nautobot.Sync.tenants(task="system", tenant=tenant, slug=tenant.replace(".", "-"), cache=cache)
+            with profile.stage("sync.tags"):
                 Nautobot.Sync.tags(
                     task="update",
                     model="tenant",
@@ -258,84 +1086,76 @@ class Data:
                     tag=dnac_tag,
                 )
 
-                # Check that the device is supported in Cisco DNA Center
-                if device.deviceSupportLevel == "Supported":
+            # Shared by the batches of the tenant
+            context = {
+                "tenant": tenant,
+                "tenant_obj": tenant_obj,
+                "dnac": dnac,
+                "site_ids": site_ids,
+                "site_members": None,
+                "site_index": None,
+                "devicetypes": set(),
+            }
+            devicetypes = context["devicetypes"]
 
-                    # Sync Manufacture
-                    device.manufacture = device.type.split()[0]
-                    device.manufacture = Nautobot.Sync.manufacturer(manufacture=device.manufacture, tenant=tenant)
+            # Get devices from Cisco DNA Center (supported serials are kept for the purge)
+            batch = []
+            listed = []
+            for device in tenants.devices(tenant=dnac):
+                position += 1
 
-                    # Sync Device Types
-                    slug = System.Slug.create(device.family)
-                    device.family_type = Nautobot.Sync.devicetype(
-                        manufacture=device.manufacture,
-                        model=device.family,
-                        slug=slug,
-                        tenant=tenant,
-                    )
-                    # Add tag to devicetype
-                    Nautobot.Sync.tags(
-                        task="update",
-                        model="devicetype",
-                        filter=slug,
-                        tag=dnac_tag,
-                    )
+                # Skip devices that haven't changed since the last sync
+                updated = device.lastUpdateTime
+                if updated is not None:
+                    if incremental is True and watermark is not None and updated <= watermark:
+                        continue
 
-                    # Sync Device Roles
-                    slug = System.Slug.create(device.role)
-                    device.role = Nautobot.Sync.devicerole(role=device.role, slug=slug, tenant=tenant)
+                # Check that the device is supported in Cisco DNA Center
+                if device.deviceSupportLevel == "Supported":
+                    listed.append(device.serialNumber)
+                    if device.serialNumber in seen:
+                        continue
 
-                    # Sync Device IP Address
-                    device.primary_ip4 = Nautobot.Sync.ipaddress(
-                        tenant=tenant,
-                        address=device.managementIpAddress,
-                        hostname=device.hostname,
-                    )
-                    # Add tags to IP Address
-                    Nautobot.Sync.tags(
-                        task="update",
-                        model="ipaddress",
-                        filter=device.primary_ip4,
-                        tag=dnac_tag,
-                    )
-                    # Device Site Location
-                    device.site = Site.objects.get(
-                        slug=site_members[device.serialNumber],
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    )
+                    # Sync Devices in batches
+                    batch.append(device)
+                    if len(batch) >= batch_size:
+                        synced = sync(batch, context)
+                        results.extend(synced)
+                        save(tenant, state, position, batch, synced, marks)
+                        batch = []
+            synced = sync(batch, context)
+            results.extend(synced)
+            save(tenant, state, position, batch, synced, marks)
 
-                    # Check if devices is reachable from Cisco DNA Center
-                    if device.reachabilityStatus == "Reachable":
-                        device.status = Status.objects.get(slug="active")
-                        device.status_label = "success"
-                    else:
-                        device.status = Status.objects.get(slug="failed")
-                        device.status_label = "danger"
+            # Add tag to Device Types
+            with profile.stage("sync.tags"):
+                Nautobot.Sync.tags(task="bulk", model=DeviceType, ids=devicetypes, tag=dnac_tag)
 
-                    # Sync Device and get status
-                    sync_status = Nautobot.Sync.device(tenant=tenant, device=device)
-                    # Add tag to device
-                    Nautobot.Sync.tags(
-                        task="update",
-                        model="device",
-                        filter=device.serialNumber,
-                        tag=dnac_tag,
+            # If device is removed in Cisco DNA Center, then remove in Nautobot
+            # (only with all devices at hand, incremental syncs leave it to the full reconcile)
+            # (the inventory is always walked in full, also when resumed, so `listed` is complete)
+            purged = {"purged": 0, "failed": []}
+            if incremental is False:
+                with profile.stage("purge.devices"):
+                    purged = Nautobot.Purge.database(
+                        tenant=tenant,
+                        type="devices",
+                        data=[{"serial": serial} for serial in listed],
+                        cache=cache,
                     )
-                    result = {
-                        "name": device.hostname,
-                        "status": device.status,
-                        "status_label": device.status_label,
-                        "role": device.role,
-                        "type": device.family_type,
-                        "site": device.site,
-                        "primary_ip4": device.primary_ip4,
-                        "serial": device.serialNumber,
-                        "sync_status": sync_status[1],
-                    }
-                    results.append(result)
+            System.Metrics.objects(tenant, "devices", results, purged["purged"])
+            results.extend(Data.purge_failed(purged["failed"]))
 
-            # If device is removed in Cisco DNA Center, then remove in Nautobot
-            Nautobot.Purge.database(tenant=tenant, type="devices", data=results)
+            # Move the watermark over the synced devices, but not past a failed one
+            if marks["synced"] is not None:
+                state.devices_watermark = max(state.devices_watermark or 0, marks["synced"])
+            if marks["failed"] is not None and state.devices_watermark is not None:
+                state.devices_watermark = min(state.devices_watermark, marks["failed"] - 1)
+            state.save(update_fields=["devices_watermark"])
+            cache.save()
+            if shared is False:
+                cache.changelog.summary(tenant)
+            Data.Inventory.invalidate(tenant)
 
             results = sorted(results, key=lambda k: k["name"], reverse=False)
             data[tenant] = results
@@ -366,5 +1186,6 @@ class Data:
         data["task"] = str(j.func_name)
         data["status"] = str(j.get_status())
         data["result"] = str(j.result)
+        data["progress"] = j.meta.get("progress", {})
         data["exception"] = str(j.exc_info)
         return data
@@ -0,0 +1,157 @@
+import time
+import uuid
+
+
+class Fake:
+    """
+    Offline Cisco DNA Center stand-in (e.g. for benchmarks), used as `CiscoDNAC.Pool.factory`
+    """
+
+    class Response(dict):
+        """
+        Attribute access like dnacentersdk responses
+        """
+
+        def __getattr__(self, key):
+            return self.get(key)
+
+        def __setattr__(self, key, value):
+            self[key] = value
+
+    families = [
+        ("Switches and Hubs", "Cisco Catalyst 9300 Switch", "C9300-48P", "ACCESS"),
+        ("Switches and Hubs", "Cisco Catalyst 9500 Switch", "C9500-40X", "DISTRIBUTION"),
+        ("Routers", "Cisco ISR 4451 Router", "ISR4451-X/K9", "BORDER ROUTER"),
+        ("Wireless Controller", "Cisco Catalyst 9800-40 Wireless Controller", "C9800-40-K9", "ACCESS"),
+        ("Unified AP", "Cisco Catalyst 9120AXI Unified Access Point", "C9120AXI-E", "ACCESS"),
+    ]
+
+    @classmethod
+    def factory(cls, sites=50, devices=1000):
+        """
+        Replacement for `dnacentersdk.api.DNACenterAPI` with generated data
+        """
+
+        def api(**kwargs):
+            return cls.API(sites=sites, devices=devices, **kwargs)
+
+        return api
+
+    class API:
+        def __init__(self, sites, devices, **kwargs):
+            self.base_url = kwargs.get("base_url", "https://dnac.invalid")
+            self.session = Fake.Response(refresh_token=lambda: None)
+
+            # Global > Areas > Buildings > Floors, devices on the floors
+            self.site_list = Fake.sites(sites)
+            floors = [site for site in self.site_list if "/Floor " in site.siteNameHierarchy]
+            self.device_list = Fake.devices(devices)
+            self.members = {}
+            for index, device in enumerate(self.device_list):
+                self.members.setdefault(floors[index % len(floors)].id, []).append(device)
+
+            self.devices = Fake.Response(
+                get_network_device_by_pagination_range=self.get_network_device_by_pagination_range,
+                get_device_count=self.get_device_count,
+            )
+            self.sites = Fake.Response(
+                get_site=self.get_site,
+                get_site_count=self.get_site_count,
+                get_membership=self.get_membership,
+            )
+
+        # Fresh objects per call (like the SDK), since the sync sets attributes on them
+        def get_network_device_by_pagination_range(self, start_index=1, records_to_return=500, **kwargs):
+            devices = self.device_list[start_index - 1 : start_index - 1 + min(records_to_return, 500)]
+            return Fake.Response(response=[Fake.Response(device) for device in devices])
+
+        def get_device_count(self, **kwargs):
+            return Fake.Response(response=len(self.device_list))
+
+        def get_site(self, **kwargs):
+            return Fake.Response(response=[Fake.Response(site) for site in self.site_list])
+
+        def get_site_count(self, **kwargs):
+            return Fake.Response(response=len(self.site_list))
+
+        def get_membership(self, site_id, **kwargs):
+            devices = [Fake.Response(serialNumber=device.serialNumber) for device in self.members.get(site_id, [])]
+            return Fake.Response(site=Fake.Response(response=[]), device=[Fake.Response(response=devices)])
+
+    @classmethod
+    def site(cls, id, name, hierarchy, type, address=None, latitude=None, longitude=None):
+        return cls.Response(
+            id=str(uuid.UUID(int=id)),
+            name=name,
+            siteNameHierarchy=hierarchy,
+            additionalInfo=[
+                {
+                    "nameSpace": "Location",
+                    "attributes": {
+                        "type": type,
+                        "country": "Sweden" if type != "area" else None,
+                        "address": address,
+                        "latitude": latitude,
+                        "longitude": longitude,
+                    },
+                }
+            ],
+        )
+
+    @classmethod
+    def sites(cls, count):
+        """
+        `count` sites, one area per 10 buildings and 3 floors per building
+        """
+        sites = [cls.Response(id=str(uuid.UUID(int=1)), name="Global", siteNameHierarchy="Global", additionalInfo=[])]
+        buildings = max(1, (count - 1) // 4)
+        for building in range(buildings):
+            area = "Global/Area {}".format(building // 10)
+            if building % 10 == 0:
+                sites.append(cls.site(len(sites) + 1, area.split("/")[-1], area, "area"))
+            hierarchy = "{}/Building {}".format(area, building)
+            sites.append(
+                cls.site(
+                    len(sites) + 1,
+                    "Building {}".format(building),
+                    hierarchy,
+                    "building",
+                    address="Street {}, Stockholm".format(building),
+                    latitude="59.{:04d}".format(building % 10000),
+                    longitude="18.{:04d}".format(building % 10000),
+                )
+            )
+            for floor in range(3):
+                sites.append(
+                    cls.site(
+                        len(sites) + 1,
+                        "Floor {}".format(floor),
+                        "{}/Floor {}".format(hierarchy, floor),
+                        "floor",
+                    )
+                )
+        return sites
+
+    @classmethod
+    def devices(cls, count):
+        devices = []
+        updated = int(time.time() * 1000)
+        for index in range(count):
+            family, type, platform, role = cls.families[index % len(cls.families)]
+            devices.append(
+                cls.Response(
+                    id=str(uuid.UUID(int=10 ** 9 + index)),
+                    hostname="device-{:05d}.example.com".format(index),
+                    family=family,
+                    type=type,
+                    platformId=platform,
+                    role=role,
+                    serialNumber="FAKE{:07d}".format(index),
+                    managementIpAddress="10.{}.{}.{}".format(index >> 16 & 255, index >> 8 & 255, index & 255),
+                    reachabilityStatus="Reachable" if index % 50 != 0 else "Unreachable",
+                    deviceSupportLevel="Supported",
+                    lastUpdateTime=updated - index,
+                    softwareVersion="17.3.4",
+                )
+            )
+        return devices
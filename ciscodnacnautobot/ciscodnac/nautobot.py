@@ -1,15 +1,217 @@
+from contextlib import contextmanager
 from decimal import Decimal
 import ipaddress
+import uuid
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from nautobot.extras.models import Tag, Status
-from nautobot.dcim.models import Site, Device, DeviceRole, DeviceType, Manufacturer
+from nautobot.extras.choices import ObjectChangeActionChoices
+from nautobot.extras.models import ObjectChange, Tag, TaggedItem, Status
+from nautobot.dcim.models import Site, Device, DeviceRole, DeviceType, Manufacturer, RackGroup, Region
 from nautobot.ipam.models import IPAddress
 from nautobot.tenancy.models import Tenant
 from nautobot.utilities.choices import ColorChoices
+from ..models import Fingerprint
 from .utilities import System
 
 
 class Nautobot:
+    class Changelog:
+        """
+        Change log of a sync, written in bulk (one record per changed object, one per sync or none)
+        """
+
+        def __init__(self):
+            self.mode = System.Config.get("changelog")
+            self.request_id = uuid.uuid4()
+            self.changes = []
+            self.counts = {}
+
+        def add(self, tenant, model, action, obj=None, count=1):
+            if self.mode == "none":
+                return
+            counts = self.counts.setdefault(tenant, {}).setdefault(model, {})
+            counts[action] = counts.get(action, 0) + count
+            if self.mode == "object" and obj is not None:
+                self.changes.append(obj.to_objectchange(action))
+
+        def remove(self, tenant, model, action, obj=None, count=1):
+            if self.mode == "none":
+                return
+            self.counts[tenant][model][action] -= count
+            if self.mode == "object" and obj is not None:
+                for i in range(len(self.changes) - 1, -1, -1):
+                    if self.changes[i].changed_object_id == obj.pk:
+                        del self.changes[i]
+                        break
+
+        def save(self):
+            """
+            Write the change records of the objects changed so far
+            """
+            for change in self.changes:
+                change.request_id = self.request_id
+                change.user_name = "ciscodnacnautobot"
+            ObjectChange.objects.bulk_create(self.changes, batch_size=System.Config.get("batch_size"))
+            self.changes = []
+
+        def summary(self, tenant):
+            """
+            One change record (on the Tenant) for the whole sync of a Cisco DNA Center
+            """
+            counts = self.counts.pop(tenant, {})
+            tenant_obj = Tenant.objects.filter(name=tenant).first()
+            if self.mode != "summary" or len(counts) == 0 or tenant_obj is None:
+                return
+            change = tenant_obj.to_objectchange(ObjectChangeActionChoices.ACTION_UPDATE)
+            change.object_repr = "Sync of {}".format(tenant)
+            change.object_data = {"ciscodnacnautobot": counts}
+            change.request_id = self.request_id
+            change.user_name = "ciscodnacnautobot"
+            ObjectChange.objects.bulk_create([change])
+
+    class Cache:
+        """
+        Sync scoped lookup cache for Nautobot objects
+        """
+
+        def __init__(self):
+            self.objects = {}
+            self.hits = 0
+            self.misses = 0
+            self.fingerprints = {}
+            self.changes = {}
+            # Undo of cache changes inside `atomic()`, in case it's rolled back
+            self.journal = None
+            self.changelog = Nautobot.Changelog()
+
+        def get(self, model, key, func):
+            """
+            Resolve (or create) the object once per sync
+            """
+            if (model, key) in self.objects:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.objects[(model, key)] = func()
+                self.undo(lambda: self.objects.pop((model, key), None))
+            return self.objects[(model, key)]
+
+        def undo(self, func):
+            if self.journal is not None:
+                self.journal.append(func)
+
+        @contextmanager
+        def atomic(self):
+            """
+            Savepoint, that also forgets objects and fingerprints cached in it when rolled back
+            """
+            outer = self.journal
+            self.journal = []
+            try:
+                with transaction.atomic():
+                    yield
+            except Exception:
+                for undo in reversed(self.journal):
+                    undo()
+                self.journal = outer
+                raise
+            journal = self.journal
+            self.journal = outer
+            if outer is not None:
+                # Undone as well if the outer savepoint is rolled back
+                outer.extend(journal)
+
+        def stats(self):
+            return {"hits": self.hits, "misses": self.misses}
+
+        def fingerprint(self, model, key, data):
+            """
+            Compare fingerprint of the synced Cisco DNA Center payload, True if changed
+            """
+            if model not in self.fingerprints:
+                # Stored fingerprints are loaded once per model
+                self.fingerprints[model] = dict(Fingerprint.objects.filter(model=model).values_list("key", "fingerprint"))
+            fingerprint = System.Fingerprint.create(data)
+            previous = self.fingerprints[model].get(key)
+            if previous == fingerprint:
+                return False
+            change = self.changes.get((model, key))
+            self.fingerprints[model][key] = fingerprint
+            self.changes[(model, key)] = fingerprint
+
+            def undo():
+                self.fingerprints[model][key] = previous
+                if change is None:
+                    self.changes.pop((model, key), None)
+                else:
+                    self.changes[(model, key)] = change
+
+            self.undo(undo)
+            return True
+
+        def save(self):
+            """
+            Store changed fingerprints in bulk
+            """
+            batch_size = System.Config.get("batch_size")
+            changes = list(self.changes.items())
+            for i in range(0, len(changes), batch_size):
+                chunk = changes[i : i + batch_size]
+                lookup = Q()
+                for (model, key), fingerprint in chunk:
+                    lookup |= Q(model=model, key=key)
+                with transaction.atomic():
+                    Fingerprint.objects.filter(lookup).delete()
+                    Fingerprint.objects.bulk_create(
+                        [Fingerprint(model=model, key=key, fingerprint=fingerprint) for (model, key), fingerprint in chunk],
+                        ignore_conflicts=True,
+                    )
+            self.changes = {}
+            self.changelog.save()
+
+        @staticmethod
+        def resolve(cache, model, key, func):
+            """
+            Lookup through the cache, if there is one
+            """
+            if cache is None:
+                return func()
+            return cache.get(model, key, func)
+
+        @staticmethod
+        def savepoint(cache):
+            """
+            Savepoint through the cache, if there is one
+            """
+            if cache is None:
+                return transaction.atomic()
+            return cache.atomic()
+
+        @staticmethod
+        def log(cache, tenant, obj, action, count=1):
+            """
+            Change log through the cache, if there is one (`obj` is a Nautobot object or model)
+            """
+            if cache is None:
+                return
+            model = obj._meta.model_name
+            if isinstance(obj, type):
+                obj = None
+            cache.changelog.add(tenant, model, action, obj=obj, count=count)
+            cache.undo(lambda: cache.changelog.remove(tenant, model, action, obj=obj, count=count))
+
+        @staticmethod
+        def changed(cache, model, key, data):
+            """
+            Fingerprint check through the cache, if there is one (else always changed)
+            """
+            if cache is None:
+                return True
+            return cache.fingerprint(model, key, data)
+
     class Sync:
         """
         Sync data to Nautobot Models
@@ -20,6 +222,9 @@ class Nautobot:
             """
             Create Tenant based on Cisco DNA Center Instance
             """
+            if kwargs.get("cache") is not None:
+                cache = kwargs.pop("cache")
+                return cache.get("tenant", kwargs["tenant"], lambda: Nautobot.Sync.tenants(**kwargs))
             if "system" in kwargs["task"]:
                 if Tenant.objects.filter(name=kwargs["tenant"]).exists() is False:
                     Tenant.objects.create(
@@ -43,6 +248,9 @@ class Nautobot:
             Handle Tag operations with Nautobot
             """
             if "system" in kwargs["task"]:
+                if kwargs.get("cache") is not None:
+                    cache = kwargs.pop("cache")
+                    return cache.get("tag", "cisco-dna-center", lambda: Nautobot.Sync.tags(**kwargs))
                 # Create mandatory Cisco DNA Center Tag
                 if len(System.PluginTag.filter()) == 0:
                     Tag.objects.create(
@@ -74,232 +282,530 @@ class Nautobot:
                     __obj = Site.objects.get(name=kwargs["filter"])
 
                 if kwargs["tag"] not in __obj.tags.all():
-                    # Add Cisco DNA Center Tag to Nautobot Object
+                    # Add Cisco DNA Center Tag to Nautobot Object (no save, only the tag changed)
                     __obj.tags.add(kwargs["tag"])
-                    __obj.save()
+            elif "bulk" in kwargs["task"]:
+                # Tag all objects (`ids`) of one `model`, only inserting missing tagged items
+                batch_size = System.Config.get("batch_size")
+                content_type = ContentType.objects.get_for_model(kwargs["model"])
+                ids = list(set(kwargs["ids"]))
+                created = 0
+                for i in range(0, len(ids), batch_size):
+                    chunk = ids[i : i + batch_size]
+                    tagged = set(
+                        TaggedItem.objects.filter(
+                            content_type=content_type,
+                            tag=kwargs["tag"],
+                            object_id__in=chunk,
+                        ).values_list("object_id", flat=True)
+                    )
+                    missing = [
+                        TaggedItem(content_type=content_type, object_id=pk, tag=kwargs["tag"])
+                        for pk in chunk
+                        if pk not in tagged
+                    ]
+                    TaggedItem.objects.bulk_create(missing)
+                    created += len(missing)
+                return created
             else:
                 raise Exception("Not implemented yet")
 
         @staticmethod
-        def site(tenant, site):
+        def site(tenant, site, cache=None):
             """
             Handle Site operations with Nautobot
             """
+            tenant_obj = Nautobot.Cache.resolve(cache, "tenant", tenant, lambda: Tenant.objects.get(name=tenant))
+
+            # Only write the site if the synced fields changed since the last sync
+            data = {
+                "name": site.siteNameHierarchy,
+                "slug": site.slug,
+                "description": "Managed by {}".format(tenant),
+                "tenant": str(tenant_obj.id),
+                "additionalInfo": site.additionalInfo,
+            }
+            changed = Nautobot.Cache.changed(cache, "site", site.id, data)
 
             # Gather site in Nautobot (site name isn't unique, even with multiple tenants)
+            # (written without save(), changes are logged by the sync instead of per save)
             if Site.objects.filter(name=site.siteNameHierarchy).exists() is False:
-                Site.objects.create(
-                    name=site.siteNameHierarchy,
-                    slug=site.slug,
-                    comments=site.id,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant),
+                Site.objects.bulk_create(
+                    [
+                        Site(
+                            name=site.siteNameHierarchy,
+                            slug=site.slug,
+                            comments=site.id,
+                            description="Managed by {}".format(tenant),
+                            tenant=tenant_obj,
+                        )
+                    ]
                 )
                 sync = "Created"
+            elif changed is False:
+                return Site.objects.get(name=site.siteNameHierarchy), "Unchanged"
             else:
                 Site.objects.filter(name=site.siteNameHierarchy).update(
                     slug=site.slug,
                     comments=site.id,
                     description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant).id,
+                    tenant=tenant_obj.id,
                 )
                 sync = "Updated"
             __obj = Site.objects.get(name=site.siteNameHierarchy)
 
             # Check if additional information is avaible for the site
-            __save = False
+            __save = {}
             if len(site.additionalInfo) != 0:
                 for additionalInfo in site.additionalInfo:
                     if "Location" in additionalInfo["nameSpace"]:
                         if additionalInfo["attributes"]["address"] is not None:
                             if __obj.physical_address != additionalInfo["attributes"]["address"]:
-                                __obj.physical_address = additionalInfo["attributes"]["address"]
-                                __save = True
+                                __save["physical_address"] = additionalInfo["attributes"]["address"]
                         if additionalInfo["attributes"]["latitude"] is not None:
                             if __obj.latitude != Decimal(additionalInfo["attributes"]["latitude"]):
-                                __obj.latitude = additionalInfo["attributes"]["latitude"]
-                                __save = True
+                                __save["latitude"] = additionalInfo["attributes"]["latitude"]
                         if additionalInfo["attributes"]["longitude"] is not None:
                             if __obj.longitude != Decimal(additionalInfo["attributes"]["longitude"]):
-                                __obj.longitude = additionalInfo["attributes"]["longitude"]
-                                __save = True
-            if __save is True:
-                # Only update Change log if something is updated
-                __obj.save()
+                                __save["longitude"] = additionalInfo["attributes"]["longitude"]
+            if len(__save) != 0:
+                Site.objects.filter(pk=__obj.pk).update(**__save)
 
-            return Site.objects.get(name=site.siteNameHierarchy), sync
+            __obj = Site.objects.get(name=site.siteNameHierarchy)
+            if sync == "Created":
+                Nautobot.Cache.log(cache, tenant, __obj, ObjectChangeActionChoices.ACTION_CREATE)
+            else:
+                Nautobot.Cache.log(cache, tenant, __obj, ObjectChangeActionChoices.ACTION_UPDATE)
+            return __obj, sync
+
+        @staticmethod
+        def level(site):
+            """
+            Level of a Cisco DNA Center site ("area", "building" or "floor", None for Global)
+            """
+            if "/" not in site.siteNameHierarchy:
+                return None
+            for additionalInfo in site.additionalInfo or []:
+                if "Location" in additionalInfo["nameSpace"]:
+                    if additionalInfo["attributes"].get("type") in ("building", "floor"):
+                        return additionalInfo["attributes"]["type"]
+            return "area"
 
         @staticmethod
-        def manufacturer(manufacture, tenant):
+        def hierarchy(tenant, sites, cache=None):
+            """
+            Handle Region (area), Site (building) and Rack Group (floor) operations with Nautobot
+            (all sites of one Cisco DNA Center, one level and depth at a time)
+            """
+            batch_size = System.Config.get("batch_size")
+            tenant_obj = Nautobot.Cache.resolve(cache, "tenant", tenant, lambda: Tenant.objects.get(name=tenant))
+            description = "Managed by {}".format(tenant)
+
+            # Tree of the sites by hierarchy name, parents before children
+            names = {site.siteNameHierarchy: site for site in sites}
+            levels = {None: [], "area": [], "building": [], "floor": []}
+            for site in sorted(sites, key=lambda site: site.siteNameHierarchy.count("/")):
+                site.parent = names.get(site.siteNameHierarchy.rsplit("/", 1)[0])
+                levels[Nautobot.Sync.level(site)].append(site)
+
+            # Synced Nautobot object and status per Cisco DNA Center site UUID
+            objs = {}
+            results = {site.id: (None, "Unchanged") for site in levels[None]}
+
+            def parent(site, level):
+                # Closest synced parent on `level` (Global isn't synced), a failed parent is skipped
+                # so its children attach to the next synced ancestor instead of failing too
+                site = site.parent
+                while site is not None and (Nautobot.Sync.level(site) != level or site.id not in objs):
+                    site = site.parent
+                if site is None:
+                    return None
+                return objs[site.id]
+
+            def region(site):
+                return {"name": site.siteNameHierarchy, "parent": parent(site, "area"), "description": description}
+
+            def building(site):
+                values = {
+                    "name": site.siteNameHierarchy,
+                    "region": parent(site, "area"),
+                    "comments": site.id,
+                    "description": description,
+                    "tenant": tenant_obj,
+                }
+                for additionalInfo in site.additionalInfo:
+                    if "Location" in additionalInfo["nameSpace"]:
+                        if additionalInfo["attributes"]["address"] is not None:
+                            values["physical_address"] = additionalInfo["attributes"]["address"]
+                        if additionalInfo["attributes"]["latitude"] is not None:
+                            values["latitude"] = Decimal(additionalInfo["attributes"]["latitude"])
+                        if additionalInfo["attributes"]["longitude"] is not None:
+                            values["longitude"] = Decimal(additionalInfo["attributes"]["longitude"])
+                return values
+
+            def floor(site):
+                values = {"name": site.name, "parent": parent(site, "floor"), "description": description}
+                values["site"] = values["parent"].site if values["parent"] is not None else parent(site, "building")
+                if values["site"] is None:
+                    raise Exception("Building of {} isn't synced".format(site.siteNameHierarchy))
+                return values
+
+            def upsert(model, level, values):
+                existing = {obj.slug: obj for obj in model.objects.filter(slug__in=[site.id for site in level])}
+                # Names held by other objects (e.g. the same area on another Cisco DNA Center) are unique
+                # for Regions and Sites, so those get the tenant appended instead of colliding
+                taken = set()
+                if model._meta.get_field("name").unique is True:
+                    taken = set(
+                        model.objects.filter(name__in=[site.siteNameHierarchy for site in level])
+                        .exclude(slug__in=[site.id for site in level])
+                        .values_list("name", flat=True)
+                    )
+                writes = []
+                fields = set()
+                moved = False
+                for site in level:
+                    try:
+                        data = values(site)
+                    except Exception as error_msg:
+                        print("Error for {}: {}".format(site.siteNameHierarchy, error_msg))
+                        results[site.id] = None, "Error: {}".format(error_msg)
+                        continue
+                    if data["name"] in taken:
+                        data["name"] = "{} ({})".format(data["name"], tenant)[: model._meta.get_field("name").max_length]
+                    obj = existing.get(site.id)
+                    if obj is None:
+                        obj = model(slug=site.id, **data)
+                        if hasattr(model, "_mptt_meta"):
+                            # Placeholder tree fields, set by the rebuild below
+                            obj.lft = obj.rght = obj.tree_id = obj.level = 0
+                        writes.append((obj, ObjectChangeActionChoices.ACTION_CREATE))
+                        results[site.id] = obj, "Created"
+                        moved = True
+                    else:
+                        # Only write objects that changed (compare on ids, no related lookups)
+                        changed = False
+                        for field, value in data.items():
+                            if getattr(obj, model._meta.get_field(field).attname) != getattr(value, "pk", value):
+                                setattr(obj, field, value)
+                                changed = True
+                                fields.add(field)
+                                moved = moved or field == "parent"
+                        if changed is True:
+                            writes.append((obj, ObjectChangeActionChoices.ACTION_UPDATE))
+                            results[site.id] = obj, "Updated"
+                        else:
+                            results[site.id] = obj, "Unchanged"
+                    objs[site.id] = obj
+
+                def write(writes):
+                    create = [obj for obj, action in writes if action == ObjectChangeActionChoices.ACTION_CREATE]
+                    update = [obj for obj, action in writes if action == ObjectChangeActionChoices.ACTION_UPDATE]
+                    with Nautobot.Cache.savepoint(cache):
+                        model.objects.bulk_create(create, batch_size=batch_size)
+                        if len(update) != 0:
+                            model.objects.bulk_update(update, sorted(fields), batch_size=batch_size)
+                        for obj, action in writes:
+                            Nautobot.Cache.log(cache, tenant, obj, action)
+
+                try:
+                    write(writes)
+                except Exception:
+                    # Retry one by one, so one object can't fail the level
+                    for obj, action in writes:
+                        try:
+                            write([(obj, action)])
+                        except Exception as error_msg:
+                            print("Error for {}: {}".format(obj.name, error_msg))
+                            results[obj.slug] = None, "Error: {}".format(error_msg)
+                            objs.pop(obj.slug, None)
+
+                return moved
+
+            # Each depth is written before its children resolve their parents, so a child never
+            # points at a parent whose insert failed (foreign keys are only checked at commit)
+            for model, level, values in (
+                (Region, levels["area"], region),
+                (Site, levels["building"], building),
+                (RackGroup, levels["floor"], floor),
+            ):
+                moved = False
+                depths = {}
+                for site in level:
+                    depths.setdefault(site.siteNameHierarchy.count("/"), []).append(site)
+                for depth in sorted(depths):
+                    moved = upsert(model, depths[depth], values) or moved
+
+                # Bulk writes skip MPTT, so the tree is rebuilt once per level
+                if moved is True and hasattr(model, "_mptt_meta"):
+                    model.objects.rebuild()
+
+            # Devices on Sites of floors (left from one Site per site) move to the Site of their building,
+            # so the purge can remove those Sites
+            floors = {site.id: objs[site.id].site_id for site in levels["floor"] if site.id in objs}
+            for pk, slug in Site.objects.filter(slug__in=list(floors), tenant=tenant_obj.id).values_list("pk", "slug"):
+                count = Device.objects.filter(site=pk, tenant=tenant_obj.id).update(site=floors[slug])
+                if count != 0:
+                    Nautobot.Cache.log(cache, tenant, Device, ObjectChangeActionChoices.ACTION_UPDATE, count)
+            return results
+
+        @staticmethod
+        def sites_index(tenant):
+            """
+            Nautobot Site per Cisco DNA Center site UUID (floors map to the Site of their building)
+            """
+            sites = {site.pk: site for site in Site.objects.filter(tenant__name=tenant).only("pk", "name", "slug")}
+            index = {site.slug: site for site in sites.values()}
+            for slug, site_id in RackGroup.objects.filter(
+                site__tenant__name=tenant,
+                description="Managed by {}".format(tenant),
+            ).values_list("slug", "site_id"):
+                # (a floor's own Site, left from before hierarchy mode, mustn't win over the building)
+                if System.Config.get("hierarchy") is True:
+                    index[slug] = sites[site_id]
+            return index
+
+        @staticmethod
+        def manufacturer(manufacture, tenant, cache=None):
             """
             Handle Manufacturer operations with Nautobot
             """
 
-            # Gather manufacture in Nautobot
-            if Manufacturer.objects.filter(name=manufacture).exists() is False:
-                Manufacturer.objects.create(
-                    name=manufacture,
-                    slug=manufacture.lower(),
-                    description="Managed by {}".format(tenant),
-                )
-            else:
-                Manufacturer.objects.filter(name=manufacture).update(
-                    slug=manufacture.lower(),
-                    description="Managed by {}".format(tenant),
-                )
-            return Manufacturer.objects.get(name=manufacture)
+            def sync():
+                # Shared by all tenants, the "Managed by" of the creating tenant isn't part of the fingerprint
+                data = {
+                    "slug": manufacture.lower(),
+                }
+                changed = Nautobot.Cache.changed(cache, "manufacturer", manufacture, data)
+
+                # Gather manufacture in Nautobot
+                if Manufacturer.objects.filter(name=manufacture).exists() is False:
+                    Manufacturer.objects.create(name=manufacture, description="Managed by {}".format(tenant), **data)
+                elif changed is True:
+                    Manufacturer.objects.filter(name=manufacture).update(**data)
+                return Manufacturer.objects.get(name=manufacture)
+
+            return Nautobot.Cache.resolve(cache, "manufacturer", manufacture, sync)
 
         @staticmethod
-        def devicetype(manufacture, model, slug, tenant):
+        def devicetype(manufacture, model, slug, tenant, cache=None):
             """
             Handle DeviceType operations with Nautobot
             """
 
-            # Gather DeviceType in Nautobot
-            if DeviceType.objects.filter(manufacturer=manufacture, model=model).exists() is False:
-                DeviceType.objects.create(
-                    manufacturer=manufacture,
-                    model=model,
-                    slug=slug.lower(),
-                    u_height=1,
-                    comments="Managed by {}".format(tenant),
-                )
-            else:
-                DeviceType.objects.filter(manufacturer=manufacture, model=model).update(
-                    slug=slug.lower(),
-                    comments="Managed by {}".format(tenant),
-                )
-            return DeviceType.objects.get(slug=slug.lower())
+            def sync():
+                # Shared by all tenants, the "Managed by" of the creating tenant isn't part of the fingerprint
+                data = {
+                    "slug": slug.lower(),
+                }
+                key = "{}/{}".format(manufacture.name, model)
+                changed = Nautobot.Cache.changed(cache, "devicetype", key, data)
+
+                # Gather DeviceType in Nautobot
+                if DeviceType.objects.filter(manufacturer=manufacture, model=model).exists() is False:
+                    DeviceType.objects.create(
+                        manufacturer=manufacture,
+                        model=model,
+                        u_height=1,
+                        comments="Managed by {}".format(tenant),
+                        **data,
+                    )
+                elif changed is True:
+                    DeviceType.objects.filter(manufacturer=manufacture, model=model).update(**data)
+                return DeviceType.objects.get(slug=slug.lower())
+
+            return Nautobot.Cache.resolve(cache, "devicetype", (manufacture.id, model), sync)
 
         @staticmethod
-        def devicerole(role, slug, tenant):
+        def devicerole(role, slug, tenant, cache=None):
             """
             Handle DeviceRole operations with Nautobot
             """
 
-            # Gather DeviceRole in Nautobot
-            if DeviceRole.objects.filter(name=role).exists() is False:
-                DeviceRole.objects.create(
-                    name=role,
-                    slug=slug.lower(),
-                    color=ColorChoices.COLOR_BLUE,
-                    vm_role=False,
-                    description="Managed by {}".format(tenant),
-                )
-            else:
-                DeviceRole.objects.filter(name=role).update(
-                    slug=slug.lower(),
-                    color=ColorChoices.COLOR_BLUE,
-                    vm_role=False,
-                    description="Managed by {}".format(tenant),
-                )
-            return DeviceRole.objects.get(name=role)
+            def sync():
+                # Shared by all tenants, the "Managed by" of the creating tenant isn't part of the fingerprint
+                data = {
+                    "slug": slug.lower(),
+                    "color": ColorChoices.COLOR_BLUE,
+                    "vm_role": False,
+                }
+                changed = Nautobot.Cache.changed(cache, "devicerole", role, data)
+
+                # Gather DeviceRole in Nautobot
+                if DeviceRole.objects.filter(name=role).exists() is False:
+                    DeviceRole.objects.create(name=role, description="Managed by {}".format(tenant), **data)
+                elif changed is True:
+                    DeviceRole.objects.filter(name=role).update(**data)
+                return DeviceRole.objects.get(name=role)
+
+            return Nautobot.Cache.resolve(cache, "devicerole", role, sync)
 
         @staticmethod
-        def device(tenant, device):
+        def devices(tenant, devices, cache=None):
             """
-            Handle Device operations with Nautobot
+            Handle Device operations with Nautobot (one batch of devices)
             """
-
-            # Check device reachability in Cisco DNA Center
-            if device.reachabilityStatus == "Reachable":
-                device.status = Status.objects.get(slug="active")
-            else:
-                device.status = Status.objects.get(slug="failed")
-
-            # Gather Device in Nautobot
-            if Device.objects.filter(serial=device.serialNumber).exists() is False:
-                if Device.objects.filter(
-                    primary_ip4=device.primary_ip4,
-                    tenant=Tenant.objects.get(name=tenant).id,
-                ).exists():
-                    # There can't be duplicate IPs in one tenant.
-                    # But DNAC can register duplicate IPs, if only one is Reachable
-                    Device.objects.create(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        serial=device.serialNumber,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant),
-                    )
+            results = {}
+            batch_size = System.Config.get("batch_size")
+            tenant_obj = Nautobot.Cache.resolve(cache, "tenant", tenant, lambda: Tenant.objects.get(name=tenant))
+
+            # Gather existing Devices for the batch in Nautobot
+            serials = [device.serialNumber for device in devices]
+            existing = {d.serial: d for d in Device.objects.filter(serial__in=serials, tenant=tenant_obj.id)}
+
+            # There can't be duplicate IPs in one tenant.
+            # But DNAC can register duplicate IPs, if only one is Reachable
+            addresses = {}
+            for serial, address in Device.objects.filter(
+                primary_ip4__in=[device.primary_ip4 for device in devices],
+                tenant=tenant_obj.id,
+            ).values_list("serial", "primary_ip4"):
+                addresses[address] = serial
+
+            create = []
+            update = []
+            ips = []
+            fields = ["name", "device_role", "device_type", "primary_ip4", "status", "site", "comments", "last_updated"]
+            for device in devices:
+                sync = "Updated" if device.serialNumber in existing else "Created"
+                primary_ip4 = device.primary_ip4
+                if addresses.get(primary_ip4.id, device.serialNumber) != device.serialNumber:
+                    primary_ip4 = None
                     sync = "Error"
-                    return Device.objects.get(serial=device.serialNumber), sync
                 else:
-                    Device.objects.create(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        primary_ip4=device.primary_ip4,
-                        serial=device.serialNumber,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant),
-                    )
-                    sync = "Created"
-            else:
-                try:
-                    # There can't be duplicate IPs in one tenant.
-                    # But DNAC can register duplicate IPs, if only one is Reachable
-                    device.serialNumber = Device.objects.get(primary_ip4=device.primary_ip4, tenant=Tenant.objects.get(name=tenant).id,).serial
-                    Device.objects.filter(serial=device.serialNumber, tenant=Tenant.objects.get(name=tenant).id,).update(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        primary_ip4=device.primary_ip4,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    )
-                    sync = "Updated"
-                except Exception as error_msg:
-                    print(error_msg)
-                    Device.objects.filter(serial=device.serialNumber, tenant=Tenant.objects.get(name=tenant).id,).update(
-                        name=device.hostname,
-                        device_role=device.role,
-                        device_type=device.family_type,
-                        status=device.status,
-                        site=device.site,
-                        comments="Managed by {}".format(tenant),
-                        tenant=Tenant.objects.get(name=tenant).id,
-                    )
-                    sync = "Error"
-                    pass
+                    addresses[primary_ip4.id] = device.serialNumber
+
+                values = {
+                    "name": device.hostname,
+                    "device_role": device.role,
+                    "device_type": device.family_type,
+                    "primary_ip4": primary_ip4,
+                    "status": device.status,
+                    "site": device.site,
+                    "comments": "Managed by {}".format(tenant),
+                }
+                if device.serialNumber not in existing:
+                    # (components of the device type are instantiated after the bulk create)
+                    obj = Device(serial=device.serialNumber, tenant=tenant_obj, **values)
+                    create.append(obj)
+                else:
+                    obj = existing[device.serialNumber]
+                    if primary_ip4 is None:
+                        # Keep current primary IP of the device if the IP is taken
+                        del values["primary_ip4"]
+
+                    # Only write devices that changed (compare on ids, no related lookups)
+                    changed = False
+                    for field, value in values.items():
+                        if getattr(obj, Device._meta.get_field(field).attname) != getattr(value, "pk", value):
+                            setattr(obj, field, value)
+                            changed = True
+                    if changed is True:
+                        # bulk_update doesn't set auto_now fields
+                        obj.last_updated = timezone.now()
+                        update.append(obj)
+                    elif sync == "Updated":
+                        sync = "Unchanged"
+                results[device.serialNumber] = (obj, sync)
+
+                # Assign IP Address to Device in Nautobot
+                if primary_ip4 is not None and primary_ip4.assigned_object_id != obj.id:
+                    primary_ip4.assigned_object_id = obj.id
+                    ips.append(primary_ip4)
+
+            Device.objects.bulk_create(create, batch_size=batch_size)
+            Nautobot.Sync.components(create)
+            Device.objects.bulk_update(update, fields, batch_size=batch_size)
+            IPAddress.objects.bulk_update(ips, ["assigned_object_id"], batch_size=batch_size)
+            for obj in create:
+                Nautobot.Cache.log(cache, tenant, obj, ObjectChangeActionChoices.ACTION_CREATE)
+            for obj in update:
+                Nautobot.Cache.log(cache, tenant, obj, ObjectChangeActionChoices.ACTION_UPDATE)
 
-            # Assign IP Address to Device in Nautobot
-            IPAddress.objects.filter(address=str(device.primary_ip4), tenant=Tenant.objects.get(name=tenant).id,).update(
-                assigned_object_id=Device.objects.get(serial=device.serialNumber).id,
-            )
+            return results
 
-            return Device.objects.get(serial=device.serialNumber), sync
+        @staticmethod
+        def components(devices):
+            """
+            Instantiate the components of the device types (like Device.save() does for new devices)
+            """
+            templates = {}
+            for device in devices:
+                # Templates are loaded once per device type (evaluated querysets are reused)
+                if device.device_type_id not in templates:
+                    device_type = device.device_type
+                    templates[device.device_type_id] = [
+                        device_type.consoleporttemplates.all(),
+                        device_type.consoleserverporttemplates.all(),
+                        device_type.powerporttemplates.all(),
+                        device_type.poweroutlettemplates.all(),
+                        device_type.interfacetemplates.all(),
+                        device_type.rearporttemplates.all(),
+                        device_type.frontporttemplates.all(),
+                        device_type.devicebaytemplates.all(),
+                    ]
+                    for queryset in templates[device.device_type_id]:
+                        len(queryset)
+                for queryset in templates[device.device_type_id]:
+                    if len(queryset) != 0:
+                        device._instantiate_components(queryset)
 
         @staticmethod
-        def ipaddress(tenant, address, hostname):
+        def ipaddresses(tenant, devices, cache=None):
             """
-            Handle IPAddress operations with Nautobot
+            Handle IPAddress operations with Nautobot (management IPs of one batch of devices)
             """
+            batch_size = System.Config.get("batch_size")
+            tenant_obj = Nautobot.Cache.resolve(cache, "tenant", tenant, lambda: Tenant.objects.get(name=tenant))
+            status = Nautobot.Cache.resolve(cache, "status", "active", lambda: Status.objects.get(slug="active"))
 
-            # Gather IPAddress in Nautobot
-            if IPAddress.objects.filter(address=address, tenant=Tenant.objects.get(name=tenant).id).exists() is False:
-                IPAddress.objects.create(
-                    address=address,
-                    status=Status.objects.get(slug="active"),
-                    dns_name=hostname,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant),
-                )
-            else:
-                IPAddress.objects.filter(address=address, tenant=Tenant.objects.get(name=tenant).id).update(
-                    status=Status.objects.get(slug="active"),
-                    dns_name=hostname,
-                    description="Managed by {}".format(tenant),
-                    tenant=Tenant.objects.get(name=tenant).id,
-                )
-            return IPAddress.objects.get(address=address)
+            # One IP Address per management IP (last device wins the DNS name)
+            hostnames = {device.managementIpAddress: device.hostname for device in devices}
+
+            # Gather existing IPAddresses for the batch in Nautobot
+            existing = {}
+            for obj in IPAddress.objects.filter(host__in=list(hostnames), tenant=tenant_obj.id):
+                existing[str(obj.host)] = obj
+
+            create = []
+            update = []
+            results = {}
+            for address, hostname in hostnames.items():
+                # Only write the IP Address if the synced fields changed since the last sync
+                data = {
+                    "status": str(status.id),
+                    "dns_name": hostname,
+                    "description": "Managed by {}".format(tenant),
+                }
+                changed = Nautobot.Cache.changed(cache, "ipaddress", "{}/{}".format(tenant, address), data)
+
+                if address not in existing:
+                    obj = IPAddress(
+                        address=address,
+                        status=status,
+                        dns_name=hostname,
+                        description="Managed by {}".format(tenant),
+                        tenant=tenant_obj,
+                    )
+                    create.append(obj)
+                else:
+                    obj = existing[address]
+                    if changed is True:
+                        obj.status = status
+                        obj.dns_name = hostname
+                        obj.description = "Managed by {}".format(tenant)
+                        update.append(obj)
+                results[address] = obj
+
+            # Written without save(), changes are logged by the sync
+            IPAddress.objects.bulk_create(create, batch_size=batch_size)
+            IPAddress.objects.bulk_update(update, ["status", "dns_name", "description"], batch_size=batch_size)
+            for obj in create:
+                Nautobot.Cache.log(cache, tenant, obj, ObjectChangeActionChoices.ACTION_CREATE)
+            for obj in update:
+                Nautobot.Cache.log(cache, tenant, obj, ObjectChangeActionChoices.ACTION_UPDATE)
+
+            return results
 
     class Purge:
         @staticmethod
@@ -308,60 +814,72 @@ class Nautobot:
             Purge data from Nautobot Database - when running Sync
             """
 
-            # Delete devices related to Tenant
-            if kwargs["type"] == "devices":
-
-                # Unique Serial Numbers in Nautobot
-                nautobot_serials = [d.serial for d in Device.objects.filter(tenant=Tenant.objects.get(name=kwargs["tenant"]).id)]
-
-                # Unique Serial Numbers in Cisco DNA Center Instance
-                dnac_serials = []
-                for d in kwargs["data"]:
-                    dnac_serials.append(d["serial"])
-
-                # Diff between Nautobot and Cisco DNA Center Instance
-                purge = list(set(nautobot_serials) - set(dnac_serials))
-
-                if len(purge) == 0:
-                    return False
-                else:
+            tenant = Nautobot.Cache.resolve(
+                kwargs.get("cache"),
+                "tenant",
+                kwargs["tenant"],
+                lambda: Tenant.objects.get(name=kwargs["tenant"]),
+            )
 
-                    # Remove diff in Nautobot
-                    try:
-                        for serial in purge:
-                            Device.objects.filter(id=Device.objects.get(serial=serial).id).delete()
-                        return True
-                    except Exception as error_msg:
-                        print("Error couldn't delete {}\n{}".format(kwargs["data"], error_msg))
-                        return False
-            # Delete sites related to Tenant
+            # Devices are unique by Serial Number, Sites/Regions/Rack Groups by slug/uuid
+            # (Regions and Rack Groups have no tenant, they are scoped by description/site)
+            if kwargs["type"] == "devices":
+                model, field, scope = Device, "serial", {"tenant": tenant.id}
             elif kwargs["type"] == "sites":
+                model, field, scope = Site, "slug", {"tenant": tenant.id}
+            elif kwargs["type"] == "regions":
+                model, field, scope = Region, "slug", {"description": "Managed by {}".format(kwargs["tenant"])}
+            elif kwargs["type"] == "rackgroups":
+                model, field = RackGroup, "slug"
+                scope = {"site__tenant": tenant.id, "description": "Managed by {}".format(kwargs["tenant"])}
+            else:
+                raise Exception("Not implemented yet")
 
-                # Unique slug/uuid in Nautobot
-                nautobot_sites = [s.slug for s in Site.objects.filter(tenant=Tenant.objects.get(name=kwargs["tenant"]).id)]
-
-                # Unique Site id/uuid in Cisco DNA Center Instance
-                dnac_sites = []
-                for s in kwargs["data"]:
-                    dnac_sites.append(s["slug"])
-
-                # Diff between Nautobot and Cisco DNA Center Instance
-                purge = list(set(nautobot_sites) - set(dnac_sites))
+            # Diff between Nautobot and Cisco DNA Center Instance (computed in the database)
+            dnac = [d[field] for d in kwargs["data"]]
+            purge = list(
+                model.objects.filter(**scope)
+                .exclude(**{"{}__in".format(field): dnac})
+                .values_list("pk", field)
+            )
 
-                if len(purge) == 0:
-                    return False
+            def log(pks):
+                # Deleted objects are only loaded when logged one by one
+                cache = kwargs.get("cache")
+                if cache is not None and cache.changelog.mode == "object":
+                    for obj in model.objects.filter(pk__in=pks):
+                        Nautobot.Cache.log(cache, kwargs["tenant"], obj, ObjectChangeActionChoices.ACTION_DELETE)
                 else:
+                    Nautobot.Cache.log(cache, kwargs["tenant"], model, ObjectChangeActionChoices.ACTION_DELETE, len(pks))
 
-                    # Remove diff in Nautobot
-                    try:
-                        for uuid in purge:
-                            Site.objects.filter(slug=uuid).delete()
-                        return True
-                    except Exception as error_msg:
-                        print("Error couldn't delete {}\n{}".format(kwargs["data"], error_msg))
-                        return False
-            else:
-                raise Exception("Not implemented yet")
+            # Remove diff in Nautobot, in chunks
+            results = {"purged": 0, "failed": []}
+            batch_size = System.Config.get("batch_size")
+            for i in range(0, len(purge), batch_size):
+                chunk = purge[i : i + batch_size]
+                try:
+                    with Nautobot.Cache.savepoint(kwargs.get("cache")):
+                        log([pk for pk, key in chunk])
+                        model.objects.filter(pk__in=[pk for pk, key in chunk]).delete()
+                    results["purged"] += len(chunk)
+                except Exception:
+                    # Retry one by one, so one object can't stop the rest of the purge
+                    for pk, key in chunk:
+                        try:
+                            with Nautobot.Cache.savepoint(kwargs.get("cache")):
+                                log([pk])
+                                model.objects.filter(pk=pk).delete()
+                            results["purged"] += 1
+                        except Exception as error_msg:
+                            print("Error couldn't delete {}\n{}".format(key, error_msg))
+                            results["failed"].append(
+                                {"type": kwargs["type"], "name": key, field: key, "error": str(error_msg)}
+                            )
+
+            # Deletes in the database skip MPTT, so the tree is rebuilt
+            if results["purged"] != 0 and hasattr(model, "_mptt_meta"):
+                model.objects.rebuild()
+            return results
 
         @classmethod
         def tenant(cls, **kwargs):
@@ -379,6 +897,7 @@ class Nautobot:
             results[tenant_name]["devices"] = cls.devices(**kwargs)
             results[tenant_name]["ipaddress"] = cls.ipaddress(**kwargs)
             results[tenant_name]["sites"] = cls.sites(**kwargs)
+            results[tenant_name]["regions"] = cls.regions(tenant=tenant_name)
             Tenant.objects.filter(pk=kwargs["pk"]).delete()
 
             return results
@@ -409,3 +928,15 @@ class Nautobot:
             result = Site.objects.filter(tenant=kwargs["pk"]).count()
             Site.objects.filter(tenant=kwargs["pk"]).delete()
             return result
+
+        @classmethod
+        def regions(cls, **kwargs):
+            """
+            Delete Regions related to Cisco DNA Center Instance (Rack Groups go with their Sites)
+            """
+            regions = Region.objects.filter(description="Managed by {}".format(kwargs["tenant"]))
+            result = regions.count()
+            regions.delete()
+            if result != 0:
+                Region.objects.rebuild()
+            return result
@@ -1,6 +1,25 @@
+import hashlib
+import json
 import re
-from django_rq import get_worker
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django_rq import get_queue, get_worker
 from django_rq.queues import get_connection
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client.core import (
+        REGISTRY,
+        CollectorRegistry,
+        CounterMetricFamily,
+        GaugeMetricFamily,
+        HistogramMetricFamily,
+    )
+except ImportError:
+    # Metrics are optional (prometheus_client ships with Nautobot)
+    REGISTRY = None
 """
 from extras.models import Tag
 from dcim.models import Site
@@ -9,6 +28,8 @@ from tenancy.models import Tenant
 from nautobot.extras.models import Tag
 from nautobot.dcim.models import Site
 from nautobot.tenancy.models import Tenant
+from .. import CiscoDNACenterConfig
+from ..models import Settings, SyncState
 
 
 class Plugin:
@@ -23,6 +44,394 @@ class System:
     Support functions for the Plugin
     """
 
+    class Config:
+        @staticmethod
+        def get(key):
+            """
+            Plugin setting from PLUGINS_CONFIG (fallback to default_settings)
+            """
+            config = settings.PLUGINS_CONFIG.get(Plugin.name, {})
+            return config.get(key, CiscoDNACenterConfig.default_settings[key])
+
+    class RateLimit:
+        """
+        Spread API calls to one Cisco DNA Center, shared across threads
+        """
+
+        __limits = {}
+        __lock = threading.Lock()
+
+        def __init__(self, rate):
+            self.interval = 1.0 / rate if rate else 0
+            self.lock = threading.Lock()
+            self.next = time.monotonic()
+
+        @classmethod
+        def get(cls, key, rate):
+            # One limiter per Cisco DNA Center (process wide)
+            with cls.__lock:
+                if key not in cls.__limits:
+                    cls.__limits[key] = cls(rate)
+                return cls.__limits[key]
+
+        def wait(self):
+            with self.lock:
+                now = time.monotonic()
+                delay = self.next - now
+                self.next = max(now, self.next) + self.interval
+            if delay > 0:
+                time.sleep(delay)
+
+    class Profile:
+        """
+        Wall time, Django queries and Cisco DNA Center requests per sync stage
+        """
+
+        def __init__(self):
+            self.stages = {}
+            self.lock = threading.Lock()
+
+        def add(self, name, **kwargs):
+            with self.lock:
+                if name not in self.stages:
+                    self.stages[name] = {"calls": 0, "seconds": 0.0, "queries": 0, "requests": 0, "request_seconds": 0.0}
+                for key, value in kwargs.items():
+                    self.stages[name][key] += value
+
+        @contextmanager
+        def stage(self, name):
+            """
+            Time a stage and count its queries (inclusive of nested stages)
+            """
+            queries = [0]
+
+            def count(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            started = time.monotonic()
+            try:
+                with connection.execute_wrapper(count):
+                    yield
+            finally:
+                self.add(name, calls=1, seconds=time.monotonic() - started, queries=queries[0])
+
+        @staticmethod
+        def call(profile, tenant, name, func, **kwargs):
+            """
+            Cisco DNA Center API call (`tenant` is the API Object), timed per stage when profiled
+            """
+            started = time.monotonic()
+            error = True
+            try:
+                result = func(**kwargs)
+                error = False
+                return result
+            finally:
+                seconds = time.monotonic() - started
+                if profile is not None:
+                    profile.add(name, requests=1, request_seconds=seconds)
+                # Every request (also of failed syncs, the dashboard, pages and exports) is in the metrics
+                System.Metrics.request(tenant.base_url.split("://", 1)[-1], name, seconds, error)
+
+        def results(self):
+            with self.lock:
+                results = {}
+                for name, stage in self.stages.items():
+                    results[name] = dict(stage, seconds=round(stage["seconds"], 3))
+                    results[name]["request_seconds"] = round(stage["request_seconds"], 3)
+                return results
+
+    class Progress:
+        """
+        Progress per Cisco DNA Center, in the meta of the RQ job (if any)
+        """
+
+        def __init__(self, job=None):
+            self.job = job
+            self.lock = threading.Lock()
+
+        def update(self, tenant, **kwargs):
+            if self.job is None:
+                return
+            with self.lock:
+                progress = self.job.meta.setdefault("progress", {})
+                progress.setdefault(tenant, {}).update(kwargs)
+                self.job.save_meta()
+
+    class Seen:
+        """
+        Serial Numbers successfully synced by a (resumable) sync, skipped when it is resumed
+        """
+
+        @staticmethod
+        def key(tenant):
+            return "ciscodnacnautobot:seen:{}".format(tenant)
+
+        @classmethod
+        def add(cls, tenant, serials):
+            if len(serials) == 0:
+                return
+            pipe = get_connection("default").pipeline(transaction=False)
+            pipe.sadd(cls.key(tenant), *serials)
+            pipe.expire(cls.key(tenant), System.Config.get("checkpoint_ttl"))
+            pipe.execute()
+
+        @classmethod
+        def get(cls, tenant):
+            return [serial.decode() for serial in get_connection("default").smembers(cls.key(tenant))]
+
+        @classmethod
+        def count(cls, tenant):
+            return get_connection("default").scard(cls.key(tenant))
+
+        @classmethod
+        def clear(cls, tenant):
+            get_connection("default").delete(cls.key(tenant))
+
+    class Lock:
+        """
+        Lease (Redis SET NX with expiry) on a sync scope, shared by web and RQ workers
+        """
+
+        # Only the owner removes the lease
+        release_script = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+        """
+
+        @staticmethod
+        def key(scope):
+            return "ciscodnacnautobot:lock:{}".format(scope)
+
+        @staticmethod
+        def scope(pk=None):
+            """
+            Sync job of one Cisco DNA Center (`pk`) or all of them
+            """
+            return "sync:all" if pk is None else "sync:{}".format(pk)
+
+        @staticmethod
+        def tenant(pk):
+            """
+            Sync of one Cisco DNA Center, by any job
+            """
+            return "tenant:{}".format(pk)
+
+        @classmethod
+        def acquire(cls, scope, owner, lease):
+            return bool(get_connection("default").set(cls.key(scope), owner, nx=True, ex=int(lease)))
+
+        @classmethod
+        def owner(cls, scope):
+            owner = get_connection("default").get(cls.key(scope))
+            return owner.decode() if owner is not None else None
+
+        @classmethod
+        def release(cls, scope, owner):
+            get_connection("default").eval(cls.release_script, 1, cls.key(scope), owner)
+
+        @classmethod
+        def alive(cls, scope, lease, grace=30):
+            """
+            Owner (RQ job) of the lease is queued or running, or the lease was just taken
+            (the owner publishes the lease before its job is enqueued)
+            """
+            owner = cls.owner(scope)
+            if owner is None:
+                return False
+            # Web requests (no RQ job) hold their lease until it expires
+            if owner.startswith("web:"):
+                return True
+            job = get_queue("default").fetch_job(owner)
+            if job is not None:
+                return job.get_status() in ["queued", "started", "deferred", "scheduled"]
+            return get_connection("default").ttl(cls.key(scope)) > lease - grace
+
+        @classmethod
+        def stale(cls, scope, lease):
+            """
+            Release the lease if its owner isn't alive anymore (e.g. worker killed)
+            """
+            owner = cls.owner(scope)
+            if owner is None:
+                return True
+            if cls.alive(scope, lease) is True:
+                return False
+            cls.release(scope, owner)
+            return True
+
+    class Metrics:
+        """
+        Prometheus metrics, kept in Redis so RQ workers and web processes share them
+        """
+
+        key = "ciscodnacnautobot:metrics"
+        buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600]
+        metrics = {
+            "sync_duration_seconds": ("histogram", "Sync duration per stage", ["tenant", "stage"]),
+            "objects_total": ("counter", "Nautobot objects synced", ["tenant", "type", "action"]),
+            "dnac_request_duration_seconds": ("histogram", "Cisco DNA Center API latency", ["tenant", "endpoint"]),
+            "dnac_errors_total": ("counter", "Cisco DNA Center API errors", ["tenant", "endpoint"]),
+            "sync_failures_total": ("counter", "Failed syncs", ["tenant"]),
+            "cache_hits_total": ("counter", "Sync lookup cache hits", ["tenant"]),
+            "cache_misses_total": ("counter", "Sync lookup cache misses", ["tenant"]),
+            "last_success_timestamp_seconds": ("gauge", "Last successful sync (unix time)", ["tenant"]),
+        }
+
+        @staticmethod
+        def field(name, labels, suffix=""):
+            return json.dumps([name, labels, suffix])
+
+        @staticmethod
+        def pipeline():
+            return get_connection("default").pipeline(transaction=False)
+
+        @classmethod
+        def inc(cls, pipe, name, labels, value=1):
+            pipe.hincrbyfloat(cls.key, cls.field(name, labels), value)
+
+        @classmethod
+        def set(cls, pipe, name, labels, value):
+            pipe.hset(cls.key, cls.field(name, labels), value)
+
+        @classmethod
+        def observe(cls, pipe, name, labels, value):
+            # Cumulative buckets, as exposed by Prometheus
+            for bucket in cls.buckets:
+                if value <= bucket:
+                    pipe.hincrbyfloat(cls.key, cls.field(name, labels, bucket), 1)
+            pipe.hincrbyfloat(cls.key, cls.field(name, labels, "+Inf"), 1)
+            pipe.hincrbyfloat(cls.key, cls.field(name, labels, "sum"), value)
+
+        @staticmethod
+        def write(pipe):
+            # Metrics never fail a sync (and can be turned off, e.g. for benchmarks)
+            if System.Config.get("metrics") is False:
+                return
+            try:
+                pipe.execute()
+            except Exception as error_msg:
+                print("Error for {}: {}".format("metrics", error_msg))
+
+        @classmethod
+        def objects(cls, tenant, type, results, purged=0):
+            """
+            Created/Updated/Unchanged/Purged objects of one sync
+            """
+            pipe = cls.pipeline()
+            for result in results:
+                if "sync_status" in result:
+                    # "Error: <message>" counts as error
+                    action = str(result["sync_status"]).split(":")[0].lower()
+                    cls.inc(pipe, "objects_total", [tenant, type, action])
+            if purged:
+                cls.inc(pipe, "objects_total", [tenant, type, "purged"], purged)
+            cls.write(pipe)
+
+        @classmethod
+        def sync(cls, tenant, profile, cache):
+            """
+            Stages and cache stats of a successful sync (requests are recorded as they happen)
+            """
+            pipe = cls.pipeline()
+            for name, stage in profile.stages.items():
+                if stage["calls"] != 0:
+                    cls.observe(pipe, "sync_duration_seconds", [tenant, name], stage["seconds"])
+            cls.inc(pipe, "cache_hits_total", [tenant], cache["hits"])
+            cls.inc(pipe, "cache_misses_total", [tenant], cache["misses"])
+            cls.set(pipe, "last_success_timestamp_seconds", [tenant], time.time())
+            cls.write(pipe)
+
+        @classmethod
+        def request(cls, tenant, endpoint, seconds, error=False):
+            """
+            Latency (and error) of one Cisco DNA Center request
+            """
+            pipe = cls.pipeline()
+            cls.observe(pipe, "dnac_request_duration_seconds", [tenant, endpoint], seconds)
+            if error is True:
+                cls.inc(pipe, "dnac_errors_total", [tenant, endpoint])
+            cls.write(pipe)
+
+        @classmethod
+        def failure(cls, tenant):
+            pipe = cls.pipeline()
+            cls.inc(pipe, "sync_failures_total", [tenant])
+            cls.write(pipe)
+
+        class Collector:
+            """
+            Prometheus collector, one HGETALL per scrape
+            """
+
+            @staticmethod
+            def families():
+                families = {}
+                for name, (type, documentation, labels) in System.Metrics.metrics.items():
+                    name = "ciscodnacnautobot_" + name
+                    if type == "histogram":
+                        families[name] = HistogramMetricFamily(name, documentation, labels=labels)
+                    elif type == "counter":
+                        families[name] = CounterMetricFamily(name, documentation, labels=labels)
+                    else:
+                        families[name] = GaugeMetricFamily(name, documentation, labels=labels)
+                return families
+
+            def describe(self):
+                # Registering doesn't touch Redis
+                return list(self.families().values())
+
+            def collect(self):
+                metrics = System.Metrics
+                families = self.families()
+                histograms = {}
+                for field, value in get_connection("default").hgetall(metrics.key).items():
+                    name, labels, suffix = json.loads(field)
+                    if name not in metrics.metrics:
+                        continue
+                    value = float(value)
+                    if metrics.metrics[name][0] != "histogram":
+                        families["ciscodnacnautobot_" + name].add_metric(labels, value)
+                        continue
+                    histogram = histograms.setdefault((name, tuple(labels)), {"buckets": {}, "sum": 0})
+                    if suffix == "sum":
+                        histogram["sum"] = value
+                    else:
+                        histogram["buckets"][suffix] = value
+
+                for (name, labels), histogram in histograms.items():
+                    buckets = [(str(float(bucket)), histogram["buckets"].get(bucket, 0)) for bucket in metrics.buckets]
+                    buckets.append(("+Inf", histogram["buckets"].get("+Inf", 0)))
+                    families["ciscodnacnautobot_" + name].add_metric(list(labels), buckets, histogram["sum"])
+                return list(families.values())
+
+        @classmethod
+        def register(cls):
+            """
+            Add the plugin metrics to Nautobot's Prometheus registry (/metrics)
+            """
+            if REGISTRY is None:
+                return
+            try:
+                REGISTRY.register(cls.Collector())
+            except ValueError:
+                # Already registered
+                pass
+
+        @classmethod
+        def export(cls):
+            """
+            Plugin metrics only, in Prometheus text format (or None)
+            """
+            if REGISTRY is None:
+                return None
+            registry = CollectorRegistry(auto_describe=False)
+            registry.register(cls.Collector())
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+
     class Check:
         @classmethod
         def tenant(cls, tenant):
@@ -45,6 +454,24 @@ class System:
         def filter():
             return Tag.objects.filter(slug="cisco-dna-center")
 
+    class State:
+        @staticmethod
+        def get(tenant):
+            """
+            Sync state of a Cisco DNA Center (by hostname)
+            """
+            dnac = Settings.objects.get(hostname=tenant)
+            return SyncState.objects.get_or_create(settings=dnac)[0]
+
+    class Fingerprint:
+        @staticmethod
+        def create(data):
+            """
+            Stable hash of Cisco DNA Center payload
+            """
+            data = json.dumps(data, sort_keys=True, default=str)
+            return hashlib.sha256(data.encode()).hexdigest()
+
     class Slug:
         def create(input):
             return re.sub(r"[\s\/]+", "-", input).lower()
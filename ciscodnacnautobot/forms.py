@@ -15,6 +15,7 @@ class SettingsForm(BootstrapMixin, CustomFieldModelForm):
             "version",
             "verify",
             "status",
+            "sync_interval",
         ]
         widgets = {
             "status": StaticSelect2(
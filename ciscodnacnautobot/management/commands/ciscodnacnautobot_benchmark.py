@@ -0,0 +1,102 @@
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from ...ciscodnac import CiscoDNAC
+from ...ciscodnac.data import Data
+from ...ciscodnac.fake import Fake
+from ...ciscodnac.utilities import System
+from ...models import Settings
+
+
+class Command(BaseCommand):
+    help = """
+    Benchmark the Cisco DNA Center sync against a generated (offline) Cisco DNA Center.
+    Everything is written in a transaction that is rolled back, use a test database.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--devices",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 50000],
+            help="Devices per run (default: 1000 10000 50000)",
+        )
+        parser.add_argument(
+            "--sites",
+            type=int,
+            default=None,
+            help="Sites per run (default: 1 per 20 devices)",
+        )
+        parser.add_argument(
+            "--no-memory",
+            action="store_true",
+            help="Skip peak memory (tracemalloc slows the sync down)",
+        )
+        parser.add_argument(
+            "--stages",
+            action="store_true",
+            help="Show time/queries per sync stage",
+        )
+
+    def handle(self, *args, **options):
+        # No rate limit towards the generated Cisco DNA Center, and no metrics of benchmark runs in Redis
+        config = dict(settings.PLUGINS_CONFIG.get("ciscodnacnautobot", {}), requests_per_second=0, metrics=False)
+        plugins_config = dict(settings.PLUGINS_CONFIG, ciscodnacnautobot=config)
+
+        self.stdout.write("{:>8} {:>8} {:>10} {:>10} {:>12}".format("Devices", "Sites", "Seconds", "Queries", "Peak (MiB)"))
+        factory = CiscoDNAC.Pool.factory
+        try:
+            with override_settings(PLUGINS_CONFIG=plugins_config):
+                for devices in options["devices"]:
+                    sites = options["sites"] or max(devices // 20, 5)
+                    CiscoDNAC.Pool.factory = Fake.factory(sites=sites, devices=devices)
+                    self.run(devices, sites, options)
+        finally:
+            CiscoDNAC.Pool.factory = factory
+
+    def run(self, devices, sites, options):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with transaction.atomic():
+            tenant = Settings.objects.create(
+                hostname="benchmark-{}.invalid".format(devices),
+                username="benchmark",
+                password="benchmark",
+                version="2.1.2",
+            )
+
+            # The generated Cisco DNA Center (its inventory in memory) isn't part of the measurement
+            CiscoDNAC.Pool.get(tenant)
+
+            if options["no_memory"] is False:
+                tracemalloc.start()
+            started = time.monotonic()
+            with connection.execute_wrapper(count):
+                result = Data.sync_tenant(pk=tenant.pk)
+            seconds = time.monotonic() - started
+            peak = 0
+            if options["no_memory"] is False:
+                peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+
+            # Leave the database (and Redis) as it was
+            transaction.set_rollback(True)
+        CiscoDNAC.Pool.invalidate(tenant.pk)
+        System.Seen.clear(tenant.hostname)
+
+        self.stdout.write("{:>8} {:>8} {:>10.2f} {:>10} {:>12.1f}".format(devices, sites, seconds, queries[0], peak))
+        if options["stages"] is True:
+            for name, stage in result.get(tenant.hostname, {}).get("profile", {}).items():
+                self.stdout.write(
+                    "    {:<20} {:>10.2f}s {:>8} queries {:>8} requests".format(
+                        name, stage["seconds"], stage["queries"], stage["requests"]
+                    )
+                )
@@ -0,0 +1,57 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from ...ciscodnac.data import Data, scheduled_sync
+
+
+class Command(BaseCommand):
+    help = """
+    Register the scheduled sync of Cisco DNA Centers (interval per Settings) with rq-scheduler.
+    Without rq-scheduler, run it with --tick every minute (e.g. from cron).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="Seconds between checks for due syncs (default: 60)",
+        )
+        parser.add_argument(
+            "--cancel",
+            action="store_true",
+            help="Remove the scheduled sync from rq-scheduler",
+        )
+        parser.add_argument(
+            "--tick",
+            action="store_true",
+            help="Start the syncs that are due now, without rq-scheduler",
+        )
+
+    def handle(self, *args, **options):
+        if options["tick"] is True:
+            for tenant, status in Data.schedule().items():
+                self.stdout.write("{}: {}".format(tenant, status))
+            return
+
+        try:
+            from django_rq import get_scheduler
+
+            scheduler = get_scheduler("default")
+        except ImportError:
+            raise CommandError("rq-scheduler is not installed, run with --tick from cron instead")
+
+        # Only one scheduled sync
+        for job in scheduler.get_jobs():
+            if job.func_name.endswith(".scheduled_sync"):
+                scheduler.cancel(job)
+        if options["cancel"] is True:
+            self.stdout.write("Scheduled sync removed")
+            return
+
+        scheduler.schedule(
+            scheduled_time=datetime.utcnow(),
+            func=scheduled_sync,
+            interval=options["interval"],
+            repeat=None,
+        )
+        self.stdout.write("Scheduled sync checks every {} seconds".format(options["interval"]))
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ciscodnacnautobot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('devices_watermark', models.BigIntegerField(blank=True, null=True)),
+                ('sites_fingerprint', models.CharField(blank=True, max_length=64)),
+                ('last_sync', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync', models.DateTimeField(blank=True, null=True)),
+                ('settings', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sync_state', to='ciscodnacnautobot.settings')),
+            ],
+            options={
+                'ordering': ['settings'],
+            },
+        ),
+    ]
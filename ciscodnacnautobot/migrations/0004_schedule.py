@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ciscodnacnautobot', '0003_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settings',
+            name='sync_interval',
+            field=models.PositiveIntegerField(default=0, help_text='Minutes between scheduled syncs (0 = disabled)'),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='next_sync',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
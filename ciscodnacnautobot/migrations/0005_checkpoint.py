@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ciscodnacnautobot', '0004_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
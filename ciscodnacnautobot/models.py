@@ -12,6 +12,7 @@ class Settings(BaseModel):
     version = models.CharField(max_length=10)
     verify = models.BooleanField(default=False)
     status = models.BooleanField(default=True)
+    sync_interval = models.PositiveIntegerField(default=0, help_text="Minutes between scheduled syncs (0 = disabled)")
     objects = RestrictedQuerySet.as_manager()
 
     class Meta:
@@ -23,3 +24,36 @@ class Settings(BaseModel):
 
     def get_absolute_url(self):
         return reverse("plugins:ciscodnacnautobot:settings")
+
+
+class SyncState(BaseModel):
+    settings = models.OneToOneField(Settings, on_delete=models.CASCADE, related_name="sync_state")
+    devices_watermark = models.BigIntegerField(blank=True, null=True)
+    sites_fingerprint = models.CharField(max_length=64, blank=True)
+    last_sync = models.DateTimeField(blank=True, null=True)
+    last_full_sync = models.DateTimeField(blank=True, null=True)
+    next_sync = models.DateTimeField(blank=True, null=True)
+    checkpoint = models.JSONField(default=dict, blank=True)
+    objects = RestrictedQuerySet.as_manager()
+
+    class Meta:
+        app_label = "ciscodnacnautobot"
+        ordering = ["settings"]
+
+    def __str__(self):
+        return str(self.settings)
+
+
+class Fingerprint(BaseModel):
+    model = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    objects = RestrictedQuerySet.as_manager()
+
+    class Meta:
+        app_label = "ciscodnacnautobot"
+        ordering = ["model", "key"]
+        unique_together = ["model", "key"]
+
+    def __str__(self):
+        return "{} {}".format(self.model, self.key)
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Settings
+from .ciscodnac import CiscoDNAC
+
+
+@receiver([post_save, post_delete], sender=Settings)
+def invalidate_dnac(sender, instance, **kwargs):
+    """
+    Authenticate again with Cisco DNA Center after Settings are changed
+    """
+    CiscoDNAC.Pool.invalidate(instance.pk)
@@ -32,6 +32,7 @@ class SettingsTable(BaseTable):
     version = tables.Column()
     verify = BooleanColumn()
     status = BooleanColumn()
+    sync_interval = tables.Column(verbose_name="Sync Interval (min)")
 
     class Meta(BaseTable.Meta):
         model = Settings
@@ -43,4 +44,5 @@ class SettingsTable(BaseTable):
             "version",
             "verify",
             "status",
+            "sync_interval",
         ]
@@ -23,6 +23,11 @@ urlpatterns = (
     path("<uuid:pk>/devices/", views.DeviceView.as_view(), name="devices"),
     path("sites/", views.SitesView.as_view(), name="sites"),
     path("<uuid:pk>/sites/", views.SitesView.as_view(), name="sites"),
+    # Export
+    path("export/devices/", views.ExportDevices.as_view(), name="export_devices"),
+    path("<uuid:pk>/export/devices/", views.ExportDevices.as_view(), name="export_devices"),
+    path("export/sites/", views.ExportSites.as_view(), name="export_sites"),
+    path("<uuid:pk>/export/sites/", views.ExportSites.as_view(), name="export_sites"),
     # Sync
     path("sync/full/", views.SyncFull.as_view(), name="sync_full"),
     path("sync/full/<uuid:id>/", views.SyncFull.as_view(), name="sync_full"),
@@ -44,6 +49,8 @@ urlpatterns = (
         views.SyncDevices.as_view(),
         name="sync_devices",
     ),
+    # Metrics
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
     # Jobs
     path("job/<uuid:id>/", views.JobStatus.as_view(), name="job_status"),
     # Purge
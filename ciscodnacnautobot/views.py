@@ -1,12 +1,13 @@
 import platform
 from django.conf import settings
-from django.http import Http404, HttpResponseServerError, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseServerError, JsonResponse, StreamingHttpResponse
 from django.views.defaults import ERROR_500_TEMPLATE_NAME
 from django.template import loader
 from django.urls import reverse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views.generic import View
 from nautobot.utilities.forms import ConfirmationForm
+from nautobot.utilities.paginator import get_paginate_count
 from nautobot.tenancy.models import Tenant
 from nautobot.core.views import generic
 from .models import Settings
@@ -67,12 +68,13 @@ class StatusView(View):
         if Settings.objects.filter().exists() is False:
             return redirect("/plugins/ciscodnacnautobot/settings/")
 
-        data = Data.status()
+        data = Data.status(refresh="refresh" in request.GET)
         return render(
             request,
             "ciscodnacnautobot/status.html",
             {
                 "dnac": data["dnac"],
+                "updated": data["updated"],
                 "nautobot": request.build_absolute_uri("/"),
                 "nautobot_sites": data["nautobot"]["sites"],
                 "nautobot_devices": data["nautobot"]["devices"],
@@ -146,6 +148,18 @@ class SyncFullFailed(View):
         )
 
 
+class MetricsView(View):
+    """
+    Plugin Prometheus Metrics
+    """
+
+    def get(self, request):
+        data = System.Metrics.export()
+        if data is None:
+            raise Http404()
+        return HttpResponse(data[0], content_type=data[1])
+
+
 class JobStatus(View):
     """
     Check RQ Job Status
@@ -164,14 +178,36 @@ class DeviceView(View):
     """
 
     def get(self, request, **kwargs):
-        data = Data.devices(**kwargs)
-        return render(
+        # Nothing to render if the cached devices didn't change since the browser saw them
+        response = Data.Inventory.conditional(request, "devices", **kwargs)
+        if response is not None:
+            return response
+
+        # Only the requested page (filtered/sorted) of each Cisco DNA Center
+        data = Data.Query.get("devices", Data.devices(**kwargs), request.GET, get_paginate_count(request))
+        response = render(
             request,
             "ciscodnacnautobot/devices.html",
             {
                 "data": data,
+                "params": request.GET,
+                "querystrings": Data.Query.querystrings(request.GET),
             },
         )
+        return Data.Inventory.headers(response, "devices", **kwargs)
+
+
+class ExportDevices(View):
+    """
+    Export Cisco DNA Center Devices (NDJSON or JSON)
+    """
+
+    def get(self, request, **kwargs):
+        format = "json" if request.GET.get("format") == "json" else "ndjson"
+        return StreamingHttpResponse(
+            Data.export("devices", format=format, **kwargs),
+            content_type="application/json" if format == "json" else "application/x-ndjson",
+        )
 
 
 class SyncDevices(View):
@@ -180,7 +216,7 @@ class SyncDevices(View):
     """
 
     def get(self, request, **kwargs):
-        data = Data.sync_devices(**kwargs)
+        data = Data.locked(Data.sync_devices, **kwargs)
         return render(
             request,
             "ciscodnacnautobot/sync_devices.html",
@@ -196,14 +232,36 @@ class SitesView(View):
     """
 
     def get(self, request, **kwargs):
-        data = Data.sites(**kwargs)
-        return render(
+        # Nothing to render if the cached sites didn't change since the browser saw them
+        response = Data.Inventory.conditional(request, "sites", **kwargs)
+        if response is not None:
+            return response
+
+        # Only the requested page (filtered/sorted) of each Cisco DNA Center
+        data = Data.Query.get("sites", Data.sites(**kwargs), request.GET, get_paginate_count(request))
+        response = render(
             request,
             "ciscodnacnautobot/sites.html",
             {
                 "data": data,
+                "params": request.GET,
+                "querystrings": Data.Query.querystrings(request.GET),
             },
         )
+        return Data.Inventory.headers(response, "sites", **kwargs)
+
+
+class ExportSites(View):
+    """
+    Export Cisco DNA Center Sites (NDJSON or JSON)
+    """
+
+    def get(self, request, **kwargs):
+        format = "json" if request.GET.get("format") == "json" else "ndjson"
+        return StreamingHttpResponse(
+            Data.export("sites", format=format, **kwargs),
+            content_type="application/json" if format == "json" else "application/x-ndjson",
+        )
 
 
 class SyncSites(View):
@@ -212,7 +270,7 @@ class SyncSites(View):
     """
 
     def get(self, request, **kwargs):
-        data = Data.sync_sites(**kwargs)
+        data = Data.locked(Data.sync_sites, **kwargs)
         return render(
             request,
             "ciscodnacnautobot/sync_sites.html",